@@ -0,0 +1,312 @@
+import contextlib
+import threading
+
+import pyaudio
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from usersettings import user_settings
+from log_setup import get_logger
+from device_probe import list_devices, list_devices_out_of_process
+
+log = get_logger("audio")
+
+DEFAULT_POLL_INTERVAL = 3.0  # seconds between hotplug scans
+PROBE_RATES = (8000, 16000, 22050, 32000, 44100, 48000)
+
+
+class AudioDevice:
+    """
+    Cached description of one PortAudio device.
+    """
+    def __init__(self, index, name, host_api, max_input_channels, max_output_channels,
+                 default_sample_rate, input_rates=(), output_rates=()):
+        self.index = index
+        self.name = name
+        self.host_api = host_api
+        self.max_input_channels = max_input_channels
+        self.max_output_channels = max_output_channels
+        self.default_sample_rate = default_sample_rate
+        self.input_rates = tuple(input_rates)
+        self.output_rates = tuple(output_rates)
+
+    @property
+    def key(self):
+        """Identity that survives index changes when devices come and go."""
+        return (self.name, self.host_api)
+
+    @property
+    def native_input_rate(self):
+        """
+        Capture rate that avoids resampling in the OS: the default rate when
+        the probe confirmed it, otherwise the best probed rate, preferring
+        integer multiples of 16 kHz.
+        """
+        rate = int(self.default_sample_rate)
+        if self.input_rates and rate not in self.input_rates:
+            rate = max(self.input_rates, key=lambda r: (r % 16000 == 0, r))
+        return rate
+
+    @property
+    def is_input(self):
+        return self.max_input_channels > 0
+
+    @property
+    def is_output(self):
+        return self.max_output_channels > 0
+
+    def __eq__(self, other):
+        return isinstance(other, AudioDevice) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return f"AudioDevice({self.index}, {self.name!r})"
+
+
+def read_devices(listing, audio, known=None):
+    """
+    Builds the device table from a ``device_probe.list_devices`` result and
+    probes the sample rates of devices not already in ``known`` (a list of
+    previously read devices) with the PyAudio instance ``audio``.
+
+    Returns ``(devices, default_input, default_output)``.
+    """
+    known = {device.key: device for device in (known or [])}
+    devices = {}
+    for info in listing["devices"]:
+        previous = known.get((info['name'], info['hostApi']))
+        if previous is not None and previous.max_input_channels == info['maxInputChannels'] \
+                and previous.max_output_channels == info['maxOutputChannels']:
+            input_rates, output_rates = previous.input_rates, previous.output_rates
+        else:
+            input_rates = _probe_rates(audio, info, input=True)
+            output_rates = _probe_rates(audio, info, input=False)
+        devices[info['index']] = AudioDevice(
+            index=info['index'],
+            name=info['name'],
+            host_api=info['hostApi'],
+            max_input_channels=info['maxInputChannels'],
+            max_output_channels=info['maxOutputChannels'],
+            default_sample_rate=info['defaultSampleRate'],
+            input_rates=input_rates,
+            output_rates=output_rates,
+        )
+    return devices, listing["default_input"], listing["default_output"]
+
+
+def device_signature(listing):
+    """
+    What identifies the set of devices in a ``list_devices`` result, ignoring
+    index order: names, channel counts and which devices are the defaults.
+    """
+    infos = {info['index']: info for info in listing["devices"]}
+
+    def key(index):
+        info = infos.get(index)
+        return (info['name'], info['hostApi']) if info is not None else None
+
+    return (frozenset((info['name'], info['hostApi'], info['maxInputChannels'], info['maxOutputChannels'])
+                      for info in listing["devices"]),
+            key(listing["default_input"]), key(listing["default_output"]))
+
+
+def _probe_rates(audio, info, input):
+    channels = info['maxInputChannels'] if input else info['maxOutputChannels']
+    if channels == 0:
+        return ()
+    rates = []
+    for rate in PROBE_RATES:
+        kwargs = {"input_device": info['index'], "input_channels": 1, "input_format": pyaudio.paInt16} if input \
+            else {"output_device": info['index'], "output_channels": 1, "output_format": pyaudio.paInt16}
+        try:
+            if audio.is_format_supported(rate, **kwargs):
+                rates.append(rate)
+        except ValueError:
+            pass
+    return rates
+
+
+class AudioDeviceManager(QObject):
+    """
+    Single owner of audio device enumeration and of the PortAudio instance
+    used for both capture and playback.
+
+    PortAudio only enumerates devices when it is first initialised, so the
+    background poll lists devices in a short-lived helper process
+    (``device_probe``) and compares the result with the cache; nothing in this
+    process is disturbed. Only when the device set has changed, or a stream
+    reported a failure, is the shared PyAudio instance re-created, and only
+    while no stream is open. The device table is then read from the new
+    instance, so cached indices always match the instance streams are opened
+    on. Streams are opened inside ``session()``; ``restart_pending`` tells a
+    capture loop that is idly waiting for speech to end its session so a
+    pending re-initialisation can run.
+    """
+    devices_changed = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._sessions = 0
+        self._reinit_due = True  # The first scan creates the instance
+        self._devices = {}
+        self._default_input = None
+        self._default_output = None
+        self._signature = None
+        self._rescan_requested = threading.Event()
+        self._stop = threading.Event()
+        self._audio = None
+        self._scanned = threading.Event()
+        self._thread = threading.Thread(target=self._watch_loop, daemon=True)
+        self._thread.start()
+
+    def devices(self, input=None, output=None):
+        """
+        Cached devices, optionally only those with input and/or output channels.
+        Waits for the first scan to complete.
+        """
+        self._scanned.wait()
+        with self._lock:
+            devices = list(self._devices.values())
+        if input:
+            devices = [device for device in devices if device.is_input]
+        if output:
+            devices = [device for device in devices if device.is_output]
+        return devices
+
+    def get(self, index):
+        self._scanned.wait()
+        with self._lock:
+            return self._devices.get(index)
+
+    def default_input(self):
+        """The system default input device, or None if there is none."""
+        self._scanned.wait()
+        with self._lock:
+            return self._devices.get(self._default_input)
+
+    def resolve_input(self, index, name=None):
+        """
+        Returns a usable input device for a saved index/name, or None for
+        the system default.
+        """
+        return self._resolve(index, name, lambda device: device.is_input)
+
+    def resolve_output(self, index, name=None):
+        """
+        Returns a usable output device for a saved index/name, or None for
+        the system default.
+        """
+        return self._resolve(index, name, lambda device: device.is_output)
+
+    def _resolve(self, index, name, usable):
+        if index is None and name is None:
+            return None
+        self._scanned.wait()
+        with self._lock:
+            device = self._devices.get(index)
+            if device is not None and usable(device) and (name is None or device.name == name):
+                return device
+            # The index may have shifted after a hotplug; look the device up by name
+            if name is not None:
+                for candidate in self._devices.values():
+                    if candidate.name == name and usable(candidate):
+                        return candidate
+        log.warning("Audio device %s (%s) is not available. Falling back to default.", index, name)
+        return None
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Context manager to hold while a capture or playback stream is open.
+        Yields the shared PyAudio instance. If devices changed since the last
+        session and no other stream is open, PortAudio is re-initialised first.
+        """
+        self._scanned.wait()
+        with self._lock:
+            if self._sessions == 0 and self._reinit_due:
+                self._reinitialize()
+            self._sessions += 1
+            audio = self._audio
+        try:
+            yield audio
+        finally:
+            with self._lock:
+                self._sessions -= 1
+
+    @property
+    def restart_pending(self):
+        """
+        True when a re-initialisation is waiting only for the caller's session
+        to end. A capture loop that is not recording should then return.
+        """
+        with self._lock:
+            return self._reinit_due and self._sessions == 1
+
+    def report_failure(self, index):
+        """
+        Called when a stream on a device fails; PortAudio is re-initialised
+        before the next stream is opened.
+        """
+        log.warning("Audio device %s failed, rescanning devices.", index)
+        with self._lock:
+            self._reinit_due = True
+        self._rescan_requested.set()
+
+    def shutdown(self):
+        self._stop.set()
+        self._rescan_requested.set()
+        with self._lock:
+            if self._audio is not None:
+                self._audio.terminate()
+                self._audio = None
+
+    def _watch_loop(self):
+        interval = user_settings.get("audio_device_poll_interval", DEFAULT_POLL_INTERVAL)
+        while not self._stop.is_set():
+            try:
+                self._poll()
+            except Exception as e:
+                log.error("Error enumerating audio devices: %s", e, exc_info=True)
+            finally:
+                self._scanned.set()
+            self._rescan_requested.wait(interval)
+            self._rescan_requested.clear()
+
+    def _poll(self):
+        with self._lock:
+            if self._audio is None or (self._reinit_due and self._sessions == 0):
+                # Nothing is streaming; re-initialise right away
+                self._reinitialize()
+                return
+        signature = device_signature(list_devices_out_of_process())
+        with self._lock:
+            if signature != self._signature and not self._reinit_due:
+                log.info("Audio device change detected; re-initialising once streams close.")
+                self._reinit_due = True
+            if self._reinit_due and self._sessions == 0:
+                self._reinitialize()
+
+    def _reinitialize(self):
+        """
+        Re-creates the PyAudio instance and reads the device table from it.
+        Must be called with the lock held and no session open.
+        """
+        if self._audio is not None:
+            self._audio.terminate()
+        self._audio = pyaudio.PyAudio()
+        listing = list_devices(self._audio)
+        devices, default_input, default_output = read_devices(listing, self._audio, self._devices.values())
+        changed = (devices != self._devices or default_input != self._default_input
+                   or default_output != self._default_output)
+        first_scan = self._signature is None
+        self._devices = devices
+        self._default_input = default_input
+        self._default_output = default_output
+        self._signature = device_signature(listing)
+        self._reinit_due = False
+        if changed and not first_scan:
+            log.info("Audio devices changed: %d devices.", len(devices))
+            self.devices_changed.emit()
+
+
+# Singleton instance
+audio_device_manager = AudioDeviceManager()
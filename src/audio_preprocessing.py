@@ -0,0 +1,188 @@
+import math
+import time
+
+import numpy as np
+from scipy import signal
+
+from log_setup import get_logger
+
+log = get_logger("audio")
+
+TARGET_RATE = 16000
+STATS_LOG_INTERVAL_S = 60.0
+
+
+class StreamingResampler:
+    """
+    Polyphase resampler for a continuous stream processed in blocks.
+
+    Uses the same Kaiser-windowed FIR design as ``scipy.signal.resample_poly``
+    but keeps filter history between blocks, so block boundaries produce no
+    discontinuities. Input is consumed in multiples of the decimation factor to
+    keep the polyphase phase aligned; any remainder waits for the next block.
+    """
+    def __init__(self, input_rate, output_rate):
+        g = math.gcd(int(input_rate), int(output_rate))
+        self.up = int(output_rate) // g
+        self.down = int(input_rate) // g
+        if self.passthrough:
+            # A cutoff of 1.0 is not a valid filter design; nothing to do anyway
+            return
+        max_rate = max(self.up, self.down)
+        half_len = 10 * max_rate
+        self.taps = signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)).astype(np.float32)
+        self.taps *= self.up
+        # History must cover the filter and be a whole number of decimation steps
+        history = math.ceil(len(self.taps) / self.up)
+        self.history_len = math.ceil(history / self.down) * self.down
+        self._history = np.zeros(self.history_len, dtype=np.float32)
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._skip = self.history_len * self.up // self.down
+
+    @property
+    def passthrough(self):
+        return self.up == 1 and self.down == 1
+
+    def process(self, samples):
+        if self.passthrough:
+            return samples
+        samples = np.concatenate((self._pending, samples))
+        usable = len(samples) - len(samples) % self.down
+        self._pending = samples[usable:]
+        if usable == 0:
+            return np.zeros(0, dtype=np.float32)
+        block = np.concatenate((self._history, samples[:usable]))
+        self._history = block[-self.history_len:]
+        count = usable * self.up // self.down
+        out = signal.upfirdn(self.taps, block, self.up, self.down)
+        return out[self._skip:self._skip + count].astype(np.float32, copy=False)
+
+
+class AudioPreprocessor:
+    """
+    Turns raw capture blocks at the device's native rate and channel count
+    into float32 mono frames at 16 kHz for the VAD and Whisper.
+
+    Stages: downmix, polyphase resampling, optional high-pass filter and
+    optional noise suppression. Output is re-framed to ``frame_size``
+    samples. A preprocessor lives for one capture stream; the processing time
+    of each block is added to the long-lived ``stats`` (``preprocessing_stats``
+    by default) so it is reported however short the streams are.
+    """
+    def __init__(self, input_rate, channels, frame_size, highpass_hz=None, noise_suppression=False, stats=None):
+        self.input_rate = int(input_rate)
+        self.channels = channels
+        self.frame_size = frame_size
+        self.resampler = StreamingResampler(self.input_rate, TARGET_RATE)
+        self.highpass = None
+        if highpass_hz:
+            sos = signal.butter(2, highpass_hz, btype='highpass', fs=TARGET_RATE, output='sos')
+            self.highpass = (sos, signal.sosfilt_zi(sos) * 0.0)
+        self.noise_gate = NoiseGate() if noise_suppression else None
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self.stats = stats if stats is not None else preprocessing_stats
+
+    @property
+    def buffered(self):
+        """Output samples held back until they fill a frame."""
+        return len(self._buffer)
+
+    def process(self, data):
+        """
+        Processes one block of interleaved int16 capture data and returns the
+        list of complete output frames it produced.
+        """
+        started = time.perf_counter()
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1)
+        samples = self.resampler.process(samples)
+        if self.highpass is not None and len(samples):
+            sos, zi = self.highpass
+            samples, zi = signal.sosfilt(sos, samples, zi=zi)
+            self.highpass = (sos, zi)
+            samples = samples.astype(np.float32, copy=False)
+        if self.noise_gate is not None and len(samples):
+            samples = self.noise_gate.process(samples)
+
+        self._buffer = np.concatenate((self._buffer, samples))
+        count = len(self._buffer) // self.frame_size
+        frames = [self._buffer[i * self.frame_size:(i + 1) * self.frame_size] for i in range(count)]
+        self._buffer = self._buffer[count * self.frame_size:]
+
+        elapsed = time.perf_counter() - started
+        self.stats.add(self.input_rate, self.channels, elapsed, len(data) / (2 * self.channels * self.input_rate))
+        return frames
+
+
+class PreprocessingStats:
+    """
+    Per-block preprocessing cost accumulated across capture streams, logged
+    per input format every ``STATS_LOG_INTERVAL_S``.
+    """
+    def __init__(self):
+        self.formats = {}
+        self._last_log = time.monotonic()
+
+    def add(self, input_rate, channels, elapsed, audio_time):
+        stats = self.formats.setdefault((input_rate, channels),
+                                        {"blocks": 0, "total_time": 0.0, "max_time": 0.0, "audio_time": 0.0})
+        stats["blocks"] += 1
+        stats["total_time"] += elapsed
+        stats["max_time"] = max(stats["max_time"], elapsed)
+        stats["audio_time"] += audio_time
+        if time.monotonic() - self._last_log >= STATS_LOG_INTERVAL_S:
+            self.log_stats()
+
+    def log_stats(self):
+        self._last_log = time.monotonic()
+        for (input_rate, channels), stats in self.formats.items():
+            blocks = max(stats["blocks"], 1)
+            log.info("Preprocessing %d Hz x%d: %d blocks, %.3f ms avg, %.3f ms max, %.2f%% of real time",
+                     input_rate, channels, stats["blocks"],
+                     1000 * stats["total_time"] / blocks, 1000 * stats["max_time"],
+                     100 * stats["total_time"] / max(stats["audio_time"], 1e-9),
+                     extra={"stage": "preprocess"})
+
+
+class NoiseGate:
+    """
+    Lightweight noise suppression: a soft downward expander that attenuates
+    signal close to a tracked noise floor. Gains are smoothed per 10 ms
+    segment to avoid clicks.
+    """
+    def __init__(self, reduction_db=12.0, margin_db=6.0, segment=TARGET_RATE // 100):
+        self.floor_gain = 10 ** (-reduction_db / 20)
+        self.margin_db = margin_db
+        self.segment = segment
+        self.noise_floor_db = -60.0
+        self._gain = 1.0
+
+    def process(self, samples):
+        usable = len(samples) - len(samples) % self.segment
+        if usable == 0:
+            return samples
+        segments = samples[:usable].reshape(-1, self.segment)
+        levels_db = 10 * np.log10(np.mean(np.square(segments), axis=1) + 1e-12)
+
+        gains = np.empty(len(segments), dtype=np.float32)
+        for i, level_db in enumerate(levels_db):
+            if level_db < self.noise_floor_db + self.margin_db:
+                # Follow the floor down quickly and up slowly
+                alpha = 0.3 if level_db < self.noise_floor_db else 0.02
+                self.noise_floor_db += alpha * (level_db - self.noise_floor_db)
+                target = self.floor_gain
+            else:
+                target = 1.0
+            self._gain += 0.5 * (target - self._gain)
+            gains[i] = self._gain
+
+        out = samples.copy()
+        out[:usable] = (segments * gains[:, None]).reshape(-1)
+        if usable < len(samples):
+            out[usable:] *= self._gain
+        return out
+
+
+# Shared by the preprocessors of successive capture streams
+preprocessing_stats = PreprocessingStats()
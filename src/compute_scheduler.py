@@ -0,0 +1,160 @@
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+import psutil
+import torch
+
+from usersettings import user_settings
+from log_setup import get_logger
+
+log = get_logger("app")
+
+# Lower number = higher priority. Capture and VAD run on reserved cores and
+# never wait; the other stages share what is left.
+STAGE_PRIORITIES = {
+    "vad": 0,
+    "asr": 1,
+    "tts": 2,
+}
+REALTIME_STAGES = ("vad",)
+
+
+class _StageStats:
+    def __init__(self):
+        self.runs = 0
+        self.waits = 0  # Runs that had to wait for cores
+        self.reduced = 0  # Runs granted fewer threads than their budget
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.run_time = 0.0
+
+    def as_dict(self):
+        return {
+            "runs": self.runs,
+            "waits": self.waits,
+            "reduced": self.reduced,
+            "wait_time": self.wait_time,
+            "max_wait": self.max_wait,
+            "run_time": self.run_time,
+        }
+
+
+class ComputeScheduler:
+    """
+    Shares the CPU cores between the inference stages.
+
+    Each stage has a thread budget (``compute_threads`` setting) and a
+    priority. Real-time stages get their cores reserved up front; the other
+    stages draw from the remaining pool, highest priority first, and are
+    granted fewer threads than their budget rather than oversubscribing the
+    machine when they overlap. Wait times are recorded per stage so the
+    budgets can be tuned for a given core count.
+
+    Thread counts are applied with ``torch.set_num_threads`` in the calling
+    thread, which OpenMP builds of torch honour per thread.
+    """
+    def __init__(self):
+        self.total_cores = user_settings.get("compute_total_cores", None) or psutil.cpu_count(logical=False) or 1
+        self.budgets = self._default_budgets()
+        self.budgets.update(user_settings.get("compute_threads", {}) or {})
+        reserved = sum(self.budgets.get(stage, 1) for stage in REALTIME_STAGES)
+        self.pool_size = max(self.total_cores - reserved, 1)
+        self._free = self.pool_size
+        self._condition = threading.Condition()
+        self._waiters = []  # Heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self._stats = {stage: _StageStats() for stage in STAGE_PRIORITIES}
+
+    def _default_budgets(self):
+        shared = max(self.total_cores - 1, 1)
+        return {
+            "vad": 1,
+            "asr": shared,
+            "tts": max(shared // 2, 1),
+        }
+
+    def configure_process(self):
+        """
+        Applies process-wide settings. Call once at startup, before importing
+        anything that loads a model (main_window starts loading TTS on
+        import), since torch only accepts the inter-op setting before its
+        first parallel operation.
+        """
+        try:
+            torch.set_num_interop_threads(user_settings.get("compute_interop_threads", 1))
+        except RuntimeError as e:
+            log.warning("Could not set torch inter-op threads: %s", e)
+        log.info("Compute scheduler: %d cores, %d shared, budgets %s",
+                 self.total_cores, self.pool_size, self.budgets)
+
+    def pin_realtime(self, stage):
+        """
+        Limits the calling thread to the reserved budget of a real-time stage.
+        """
+        torch.set_num_threads(self.budgets.get(stage, 1))
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """
+        Context manager that runs a block with the stage's share of the cores.
+        Blocks while higher-priority stages hold the pool.
+        """
+        budget = min(self.budgets.get(stage, 1), self.pool_size)
+        priority = STAGE_PRIORITIES.get(stage, max(STAGE_PRIORITIES.values()) + 1)
+        stats = self._stats.setdefault(stage, _StageStats())
+
+        requested = time.perf_counter()
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            waited = False
+            while self._free == 0 or self._waiters[0] != ticket:
+                waited = True
+                self._condition.wait()
+            heapq.heappop(self._waiters)
+            granted = min(budget, self._free)
+            self._free -= granted
+            # Let the next waiter take whatever is left
+            self._condition.notify_all()
+        wait_time = time.perf_counter() - requested
+
+        previous_threads = torch.get_num_threads()
+        torch.set_num_threads(granted)
+        started = time.perf_counter()
+        try:
+            yield granted
+        finally:
+            run_time = time.perf_counter() - started
+            torch.set_num_threads(previous_threads)
+            with self._condition:
+                self._free += granted
+                stats.runs += 1
+                stats.waits += waited
+                stats.reduced += granted < budget
+                stats.wait_time += wait_time
+                stats.max_wait = max(stats.max_wait, wait_time)
+                stats.run_time += run_time
+                self._condition.notify_all()
+            log.debug("Stage %s ran with %d/%d threads after waiting %.3f s.", stage, granted, budget, wait_time,
+                      extra={"stage": stage, "duration": run_time})
+
+    def stats(self):
+        """
+        Returns contention statistics per stage.
+        """
+        with self._condition:
+            return {stage: stats.as_dict() for stage, stats in self._stats.items()}
+
+    def log_stats(self):
+        for stage, stats in self.stats().items():
+            if stats["runs"]:
+                log.info("Stage %s: %d runs, %d waited (max %.3f s, total %.3f s), %d with reduced threads, "
+                         "%.1f s busy", stage, stats["runs"], stats["waits"], stats["max_wait"],
+                         stats["wait_time"], stats["reduced"], stats["run_time"])
+
+
+# Singleton instance
+compute_scheduler = ComputeScheduler()
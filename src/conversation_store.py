@@ -0,0 +1,242 @@
+import hashlib
+import io
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from usersettings import user_settings
+from log_setup import get_logger
+
+log = get_logger("app")
+
+DATABASE_FILE = os.path.join(os.path.dirname(__file__), 'conversations.db')
+DEFAULT_RETENTION_DAYS = 90
+THUMBNAIL_SIZE = (160, 90)
+WRITE_BATCH = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    turn_id INTEGER,
+    created_at REAL NOT NULL,
+    transcript TEXT NOT NULL,
+    response TEXT,
+    record_ms REAL,
+    transcribe_ms REAL,
+    llm_ms REAL,
+    tts_ms REAL,
+    screenshot_hash TEXT,
+    screenshot_thumbnail BLOB
+);
+CREATE INDEX IF NOT EXISTS turns_created_at ON turns(created_at);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+    transcript, response, content='turns', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts(rowid, transcript, response) VALUES (new.id, new.transcript, new.response);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_fts_delete AFTER DELETE ON turns BEGIN
+    INSERT INTO turns_fts(turns_fts, rowid, transcript, response)
+    VALUES ('delete', old.id, old.transcript, old.response);
+END;
+"""
+
+COLUMNS = ("id", "session_id", "turn_id", "created_at", "transcript", "response",
+           "record_ms", "transcribe_ms", "llm_ms", "tts_ms", "screenshot_hash")
+
+
+def screenshot_fingerprint(screenshot_path):
+    """
+    Returns ``(sha256, png_thumbnail_bytes)`` for a screenshot file.
+    """
+    from PIL import Image
+
+    with open(screenshot_path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail(THUMBNAIL_SIZE)
+        thumbnail = io.BytesIO()
+        image.save(thumbnail, "PNG")
+    return digest, thumbnail.getvalue()
+
+
+class ConversationStore:
+    """
+    Persists every conversation turn to SQLite with a full-text index.
+
+    Writes are queued and committed in batches by a background thread so the
+    audio and response threads never wait on disk. Reads (search, export,
+    recent history) use a separate connection; the database runs in WAL mode
+    so they do not block the writer.
+    """
+    def __init__(self, path=DATABASE_FILE):
+        self.path = path
+        self.session_id = uuid.uuid4().hex
+        self._queue = queue.Queue()
+        self._read_lock = threading.Lock()
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._reader.row_factory = sqlite3.Row
+        self._reader.execute("PRAGMA journal_mode=WAL")
+        self._reader.executescript(SCHEMA)
+        self.has_fts = self._create_fts(self._reader)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def _create_fts(connection):
+        try:
+            connection.executescript(FTS_SCHEMA)
+            return True
+        except sqlite3.OperationalError as e:
+            # SQLite builds without FTS5 fall back to LIKE searches
+            log.warning("Full-text search unavailable: %s", e)
+            return False
+
+    def record_turn(self, transcript, response=None, turn_id=None, timings=None, screenshot_path=None):
+        """
+        Queues a turn for writing. ``timings`` maps ``record``, ``transcribe``,
+        ``llm`` and ``tts`` to durations in seconds.
+        """
+        self._queue.put({
+            "transcript": transcript,
+            "response": response,
+            "turn_id": turn_id,
+            "timings": timings or {},
+            "screenshot_path": screenshot_path,
+            "created_at": time.time(),
+        })
+
+    def _write_loop(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            # Drain whatever else is waiting so it commits in one transaction
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            rows = [self._to_row(item) for item in batch if item is not None]
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO turns (session_id, turn_id, created_at, transcript, response, record_ms, "
+                        "transcribe_ms, llm_ms, tts_ms, screenshot_hash, screenshot_thumbnail) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                log.error("Error writing conversation turns: %s", e, exc_info=True)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                connection.close()
+                return
+
+    def _to_row(self, item):
+        timings = item["timings"]
+        screenshot_hash = thumbnail = None
+        if item["screenshot_path"]:
+            try:
+                screenshot_hash, thumbnail = screenshot_fingerprint(item["screenshot_path"])
+            except Exception as e:
+                log.warning("Could not fingerprint screenshot: %s", e)
+
+        def ms(stage):
+            value = timings.get(stage)
+            return round(value * 1000, 1) if value is not None else None
+
+        return (self.session_id, item["turn_id"], item["created_at"], item["transcript"], item["response"],
+                ms("record"), ms("transcribe"), ms("llm"), ms("tts"), screenshot_hash, thumbnail)
+
+    def flush(self):
+        """Blocks until all queued turns are written."""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+        with self._read_lock:
+            self._reader.close()
+
+    def _query(self, sql, params=()):
+        with self._read_lock:
+            return [dict(row) for row in self._reader.execute(sql, params)]
+
+    def recent(self, limit=100):
+        """The most recent turns, oldest first."""
+        rows = self._query(f"SELECT {', '.join(COLUMNS)} FROM turns ORDER BY id DESC LIMIT ?", (limit,))
+        return rows[::-1]
+
+    def search(self, text, limit=100):
+        """
+        Full-text search over transcripts and responses, best matches first.
+        The last term matches as a prefix, so results show up while the user
+        is still typing a word.
+        """
+        text = text.strip()
+        if not text:
+            return []
+        if self.has_fts:
+            # Quote each term so user input is never parsed as FTS syntax
+            terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+            terms[-1] += "*"
+            terms = " ".join(terms)
+            columns = ", ".join(f"turns.{column}" for column in COLUMNS)
+            return self._query(
+                f"SELECT {columns} FROM turns_fts JOIN turns ON turns.id = turns_fts.rowid "
+                "WHERE turns_fts MATCH ? ORDER BY rank LIMIT ?", (terms, limit))
+        pattern = f"%{text}%"
+        return self._query(
+            f"SELECT {', '.join(COLUMNS)} FROM turns WHERE transcript LIKE ? OR response LIKE ? "
+            "ORDER BY id DESC LIMIT ?", (pattern, pattern, limit))
+
+    def export(self, path):
+        """
+        Writes every turn to ``path`` as JSON lines, oldest first. Returns
+        the number of turns written.
+        """
+        self.flush()
+        count = 0
+        with self._read_lock, open(path, "w", encoding="utf-8") as f:
+            for row in self._reader.execute(f"SELECT {', '.join(COLUMNS)} FROM turns ORDER BY id"):
+                f.write(json.dumps(dict(row)) + "\n")
+                count += 1
+        return count
+
+    def prune(self, max_age_days=None, max_turns=None):
+        """
+        Deletes turns older than ``max_age_days`` and all but the newest
+        ``max_turns``. Defaults come from the ``history_retention_days`` and
+        ``history_max_turns`` settings. Returns the number of turns deleted.
+        """
+        if max_age_days is None:
+            max_age_days = user_settings.get("history_retention_days", DEFAULT_RETENTION_DAYS)
+        if max_turns is None:
+            max_turns = user_settings.get("history_max_turns", None)
+        deleted = 0
+        with self._read_lock, self._reader:
+            if max_age_days:
+                cutoff = time.time() - max_age_days * 86400
+                deleted += self._reader.execute("DELETE FROM turns WHERE created_at < ?", (cutoff,)).rowcount
+            if max_turns:
+                deleted += self._reader.execute(
+                    "DELETE FROM turns WHERE id NOT IN (SELECT id FROM turns ORDER BY id DESC LIMIT ?)",
+                    (max_turns,)).rowcount
+        if deleted:
+            log.info("Pruned %d conversation turns.", deleted)
+        return deleted
+
+
+# Singleton instance
+conversation_store = ConversationStore()
@@ -0,0 +1,56 @@
+import json
+import subprocess
+import sys
+
+import pyaudio
+
+# PortAudio only enumerates devices when it is first initialised in a process.
+# Running this file as a separate process gives a fresh enumeration without
+# disturbing the streams of the application's own PortAudio instance.
+
+PROBE_TIMEOUT = 10.0  # seconds
+
+
+def list_devices(audio):
+    """
+    Returns ``{"devices": [...], "default_input": i, "default_output": i}``
+    for a PyAudio instance, with the device info dictionaries PortAudio reports.
+    """
+    return {
+        "devices": [audio.get_device_info_by_index(i) for i in range(audio.get_device_count())],
+        "default_input": _default_index(audio.get_default_input_device_info),
+        "default_output": _default_index(audio.get_default_output_device_info),
+    }
+
+
+def _default_index(query):
+    try:
+        return query()['index']
+    except (IOError, OSError):
+        return None
+
+
+def list_devices_out_of_process():
+    """
+    Runs ``list_devices`` in a child process, so devices plugged in or removed
+    since this process initialised PortAudio are seen.
+    """
+    result = subprocess.run(
+        [sys.executable, __file__],
+        capture_output=True, text=True, timeout=PROBE_TIMEOUT, check=True,
+        # Keep a console window from flashing up on Windows
+        creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+    )
+    return json.loads(result.stdout)
+
+
+def main():
+    audio = pyaudio.PyAudio()
+    try:
+        json.dump(list_devices(audio), sys.stdout)
+    finally:
+        audio.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import collections
+import threading
+import time
+
+import numpy as np
+from scipy import signal
+
+from log_setup import get_logger
+
+log = get_logger("audio")
+
+SAMPLE_RATE = 16000
+REFERENCE_SECONDS = 4.0
+MAX_DELAY_S = 0.5  # Longest playback-to-capture delay searched for
+DEFAULT_DELAY_S = 0.12  # Used until the delay has been measured
+DELAY_WINDOW_S = 1.0
+DELAY_UPDATE_INTERVAL_S = 1.0
+ACTIVE_TAIL_S = 0.3  # Room echo can outlast the playback slightly
+BARGE_IN_FRAMES = 3  # Consecutive speech frames (about 100 ms) needed to interrupt
+ECHO_ONLY_CORRELATION = 0.8  # Spectral correlation above which a frame is taken to be pure echo
+CONVERGED_FRAMES = 10  # Echo-only frames learned before barge-in is trusted
+
+
+class EchoReference:
+    """
+    Record of what the speaker played, at 16 kHz mono, time-stamped with
+    ``time.monotonic()`` so capture frames can be matched against it.
+    Written by the TTS playback thread and read by the capture thread.
+    """
+    def __init__(self, seconds=REFERENCE_SECONDS):
+        self.seconds = seconds
+        self._segments = collections.deque()
+        self._lock = threading.Lock()
+        self._last_end = 0.0
+
+    def push(self, samples, start_time=None):
+        """Adds 16 kHz mono samples that start playing at ``start_time``."""
+        start_time = time.monotonic() if start_time is None else start_time
+        samples = np.asarray(samples, dtype=np.float32)
+        with self._lock:
+            self._segments.append((start_time, samples))
+            self._last_end = max(self._last_end, start_time + len(samples) / SAMPLE_RATE)
+            while self._segments and self._segments[0][0] < start_time - self.seconds:
+                self._segments.popleft()
+
+    def active(self, now=None):
+        """True while playback is running or has just ended."""
+        now = time.monotonic() if now is None else now
+        return now < self._last_end + ACTIVE_TAIL_S
+
+    def get(self, end_time, count):
+        """
+        Returns the ``count`` samples that were played up to ``end_time``;
+        gaps without playback are zeros.
+        """
+        out = np.zeros(count, dtype=np.float32)
+        start_time = end_time - count / SAMPLE_RATE
+        with self._lock:
+            segments = list(self._segments)
+        for seg_start, samples in segments:
+            seg_end = seg_start + len(samples) / SAMPLE_RATE
+            if seg_end <= start_time or seg_start >= end_time:
+                continue
+            src = max(int(round((start_time - seg_start) * SAMPLE_RATE)), 0)
+            dst = max(int(round((seg_start - start_time) * SAMPLE_RATE)), 0)
+            n = min(len(samples) - src, count - dst)
+            if n > 0:
+                out[dst:dst + n] = samples[src:src + n]
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._segments.clear()
+            self._last_end = 0.0
+
+
+def resample_for_reference(samples, rate):
+    """Converts playback audio (any rate, mono or multi-channel) to 16 kHz mono."""
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    if int(rate) == SAMPLE_RATE:
+        return samples
+    return signal.resample_poly(samples, SAMPLE_RATE, int(rate)).astype(np.float32)
+
+
+class EchoSuppressor:
+    """
+    Removes the assistant's own voice from capture frames before the VAD.
+
+    The playback-to-capture delay is measured by cross-correlating recent
+    microphone audio with the reference. The echo path is modelled as a
+    per-frequency magnitude gain, learned on frames whose spectrum correlates
+    closely with the reference (only the assistant is audible), and the
+    predicted echo spectrum is subtracted from each frame. Until
+    ``CONVERGED_FRAMES`` such frames have been learned, ``converged`` is
+    False and the residual is not trusted for barge-in decisions.
+    """
+    def __init__(self, reference, frame_size, over_subtraction=1.5, floor=0.05):
+        self.reference = reference
+        self.frame_size = frame_size
+        self.over_subtraction = over_subtraction
+        self.floor = floor
+        self.delay = DEFAULT_DELAY_S
+        self.echo_gain = np.full(frame_size // 2 + 1, 0.5, dtype=np.float32)
+        self._mic_history = collections.deque(maxlen=int(DELAY_WINDOW_S * SAMPLE_RATE / frame_size) + 1)
+        self._mic_history_end = 0.0
+        self._last_delay_update = 0.0
+        self.learned_frames = 0
+        self.residual_ratio = 1.0  # Residual energy over predicted echo energy for the last frame
+
+    @property
+    def converged(self):
+        return self.learned_frames >= CONVERGED_FRAMES
+
+    def process(self, frame, frame_end_time):
+        """
+        Returns the frame with the echo suppressed and updates
+        ``residual_ratio``: infinite when nothing was played recently, 0.0
+        when echo may be arriving that cannot be predicted yet.
+        """
+        self._mic_history.append(frame)
+        self._mic_history_end = frame_end_time
+        if not self.reference.active(frame_end_time):
+            self.residual_ratio = float("inf")
+            return frame
+
+        if frame_end_time - self._last_delay_update > DELAY_UPDATE_INTERVAL_S:
+            self._last_delay_update = frame_end_time
+            self._update_delay()
+
+        ref = self.reference.get(frame_end_time - self.delay, self.frame_size)
+        mic_spec = np.fft.rfft(frame)
+        ref_mag = np.abs(np.fft.rfft(ref))
+        mic_mag = np.abs(mic_spec)
+
+        ref_energy = float(np.sum(ref_mag ** 2))
+        if ref_energy < 1e-6:
+            # Nothing aligned with this frame, but if anything was played within
+            # the longest possible delay (e.g. the start of playback while the
+            # delay is still over-estimated) the frame may be echo
+            recent = self.reference.get(frame_end_time, int(MAX_DELAY_S * SAMPLE_RATE))
+            self.residual_ratio = 0.0 if np.any(recent) else float("inf")
+            return frame
+
+        active_bins = ref_mag > 0.1 * ref_mag.max()
+        if active_bins.sum() >= 4 and np.corrcoef(mic_mag[active_bins], ref_mag[active_bins])[0, 1] \
+                > ECHO_ONLY_CORRELATION:
+            # Only the assistant is audible: learn the echo path. Average over
+            # the first frames, then track slowly.
+            rate = max(1.0 / (self.learned_frames + 1), 0.1)
+            ratio = np.minimum(mic_mag[active_bins] / (ref_mag[active_bins] + 1e-6), 8.0)
+            self.echo_gain[active_bins] += rate * (ratio - self.echo_gain[active_bins])
+            self.learned_frames += 1
+
+        echo_mag = self.echo_gain * ref_mag
+        gains = np.maximum(1.0 - self.over_subtraction * echo_mag / (mic_mag + 1e-9), self.floor)
+        cleaned = np.fft.irfft(mic_spec * gains, n=self.frame_size).astype(np.float32)
+
+        self.residual_ratio = float(np.sum((gains * mic_mag) ** 2) / (np.sum(echo_mag ** 2) + 1e-9))
+        return cleaned
+
+    def _update_delay(self):
+        """Re-estimates the playback-to-capture delay by cross-correlation."""
+        if len(self._mic_history) < self._mic_history.maxlen:
+            return
+        mic = np.concatenate(self._mic_history)
+        max_lag = int(MAX_DELAY_S * SAMPLE_RATE)
+        ref = self.reference.get(self._mic_history_end, len(mic) + max_lag)
+        if np.sum(ref ** 2) < 1e-3 or np.sum(mic ** 2) < 1e-6:
+            return
+        # corr[k] compares mic with the reference delayed by (max_lag - k) samples
+        corr = signal.correlate(ref, mic, mode='valid', method='fft')
+        peak = int(np.argmax(np.abs(corr)))
+        norm = np.sqrt(np.sum(mic ** 2) * np.sum(ref[peak:peak + len(mic)] ** 2)) + 1e-9
+        if abs(corr[peak]) / norm < 0.3:
+            return
+        delay = (max_lag - peak) / SAMPLE_RATE
+        if abs(delay - self.delay) > 0.005:
+            log.debug("Echo delay estimate %.0f ms.", delay * 1000)
+        self.delay = delay
+
+
+class BargeInDetector:
+    """
+    Decides when speech heard during playback is the user interrupting rather
+    than residual echo, and keeps counts to measure false triggers.
+    """
+    def __init__(self, frames_required=BARGE_IN_FRAMES, min_residual_ratio=2.0):
+        self.frames_required = frames_required
+        self.min_residual_ratio = min_residual_ratio
+        self._count = 0
+        self.stats = {"playback_frames": 0, "playback_speech_frames": 0, "barge_ins": 0, "false_barge_ins": 0}
+
+    def update(self, speech_prob, residual_ratio, echo_converged=True):
+        """
+        Feeds one frame captured during playback; returns True when playback
+        should be interrupted. Nothing counts as a barge-in until the echo
+        path has converged, since the residual is meaningless before then.
+        """
+        self.stats["playback_frames"] += 1
+        if speech_prob > 0.5:
+            self.stats["playback_speech_frames"] += 1
+        # Speech well above the predicted echo level counts as the user talking
+        if speech_prob > 0.5 and echo_converged and residual_ratio > self.min_residual_ratio:
+            self._count += 1
+        else:
+            self._count = 0
+        if self._count >= self.frames_required:
+            self._count = 0
+            self.stats["barge_ins"] += 1
+            return True
+        return False
+
+    def reset(self):
+        self._count = 0
+
+    def report_false_trigger(self):
+        """Called when a barge-in turned out to contain no words."""
+        self.stats["false_barge_ins"] += 1
+
+    def log_stats(self):
+        stats = self.stats
+        log.info("Barge-in: %d interruptions, %d false (%.1f%%), %d of %d playback frames flagged as speech",
+                 stats["barge_ins"], stats["false_barge_ins"],
+                 100 * stats["false_barge_ins"] / max(stats["barge_ins"], 1),
+                 stats["playback_speech_frames"], stats["playback_frames"])
+
+
+# Shared between TTS playback and capture
+echo_reference = EchoReference()
@@ -0,0 +1,219 @@
+import collections
+import threading
+import time
+
+import numpy as np
+
+from usersettings import user_settings
+from log_setup import get_logger
+
+log = get_logger("vad")
+
+CONTINUE = "continue"
+SPECULATE = "speculate"
+END = "end"
+
+DEFAULT_MIN_SILENCE = 0.5  # seconds
+DEFAULT_MAX_SILENCE = 2.0
+DEFAULT_SPECULATE_AFTER = 0.3
+DEFAULT_INITIAL_SILENCE = 1.0  # Used until enough pauses have been observed
+DEFAULT_RESPECULATE_AFTER = 1.0  # Seconds of speech after a cancelled speculation before the next one
+MIN_PAUSE = 0.15  # Shorter gaps are just between words
+MIN_PAUSE_SAMPLES = 5
+PREMATURE_END_WINDOW = 1.0  # Speech resuming this soon after an END means the END was premature
+PREMATURE_END_PENALTY = 0.15  # Seconds added to the required silence per premature END
+PENALTY_DECAY = 0.02  # Seconds removed per END that was not premature
+
+# A transcript ending in one of these words is very likely unfinished
+CONTINUATION_WORDS = {
+    "and", "but", "or", "so", "because", "then", "if", "the", "a", "an", "to", "of",
+    "with", "um", "uh", "like", "which", "that",
+}
+
+
+class EndpointDetector:
+    """
+    Decides when the user has finished speaking.
+
+    Instead of a fixed silence timeout, the required silence adapts to the
+    pauses this user makes mid-utterance, to the trend of the VAD probability,
+    and to whether the partial transcript looks like a finished sentence.
+    ``update`` returns SPECULATE once per pause, at the first short pause, so a
+    response can be prepared before the end of the utterance is certain. After
+    the user resumes talking, the next speculation waits until they have
+    spoken for a while, so a long utterance does not start a transcription at
+    every breath.
+
+    Pauses long enough to end the utterance are never seen as mid-utterance
+    pauses, so when the user starts talking again within
+    ``PREMATURE_END_WINDOW`` of an END, that END is treated as premature: the
+    whole pause is recorded and the required silence is raised.
+    """
+    def __init__(self, frame_duration, min_silence=None, max_silence=None, speculate_after=None):
+        self.frame_duration = frame_duration
+        self.min_silence = min_silence or user_settings.get("endpoint_min_silence", DEFAULT_MIN_SILENCE)
+        self.max_silence = max_silence or user_settings.get("endpoint_max_silence", DEFAULT_MAX_SILENCE)
+        self.speculate_after = speculate_after or user_settings.get("endpoint_speculate_after",
+                                                                   DEFAULT_SPECULATE_AFTER)
+        self.respeculate_frames = int(user_settings.get("endpoint_respeculate_after",
+                                                        DEFAULT_RESPECULATE_AFTER) / frame_duration)
+        self.pause_history = collections.deque(maxlen=200)
+        self.penalty = 0.0  # Extra silence learned from premature ENDs
+        self._ended_at = None
+        self._end_pause = 0.0
+        self.start_utterance()
+
+    def start_utterance(self, now=None):
+        """
+        Resets for a new utterance; called at speech onset.
+        """
+        now = time.monotonic() if now is None else now
+        if self._ended_at is not None:
+            gap = now - self._ended_at
+            if gap < PREMATURE_END_WINDOW:
+                pause = self._end_pause + gap
+                self.pause_history.append(pause)
+                self.penalty = min(self.penalty + PREMATURE_END_PENALTY, self.max_silence)
+                log.info("Utterance ended too early (resumed after a %.2f s pause); waiting %.2f s longer.",
+                         pause, self.penalty)
+            else:
+                self.penalty = max(self.penalty - PENALTY_DECAY, 0.0)
+            self._ended_at = None
+        self.silence_frames = 0
+        self.prob_trend = 1.0
+        self.transcript_hint = None
+        self.speculated = False
+        self.speculation_cooldown = 0  # Speech frames left before speculating again
+
+    def update(self, speech_prob):
+        """
+        Feeds the speech probability of the next frame and returns CONTINUE,
+        SPECULATE or END.
+        """
+        self.prob_trend = 0.8 * self.prob_trend + 0.2 * speech_prob
+        if speech_prob > 0.5:
+            pause = self.silence_frames * self.frame_duration
+            if pause >= MIN_PAUSE:
+                # The user resumed: this was a mid-utterance pause
+                self.pause_history.append(pause)
+            if self.speculated:
+                # The speculation for this pause is stale; debounce the next one
+                self.speculation_cooldown = self.respeculate_frames
+            elif self.speculation_cooldown > 0:
+                self.speculation_cooldown -= 1
+            self.silence_frames = 0
+            self.speculated = False
+            self.transcript_hint = None
+            return CONTINUE
+
+        self.silence_frames += 1
+        pause = self.silence_frames * self.frame_duration
+        if pause >= self.required_silence():
+            self._ended_at = time.monotonic()
+            self._end_pause = pause
+            return END
+        if not self.speculated and not self.speculation_cooldown and pause >= self.speculate_after:
+            self.speculated = True
+            return SPECULATE
+        return CONTINUE
+
+    def required_silence(self):
+        """
+        Seconds of silence after which the utterance is considered finished.
+        """
+        if len(self.pause_history) >= MIN_PAUSE_SAMPLES:
+            # Wait a little longer than nearly all of this user's own pauses
+            silence = 1.25 * float(np.percentile(self.pause_history, 90))
+        else:
+            silence = DEFAULT_INITIAL_SILENCE
+        silence += self.penalty
+
+        if self.transcript_hint == "final":
+            silence *= 0.6
+        elif self.transcript_hint == "continue":
+            silence = self.max_silence
+
+        # Lingering mid-range VAD probabilities mean the speech is trailing
+        # off rather than stopped (breath, a drawn-out word)
+        if self.prob_trend > 0.3:
+            silence *= 1.2
+
+        return min(max(silence, self.min_silence), self.max_silence)
+
+    def set_partial_transcript(self, text):
+        """
+        Uses the transcript of the audio so far to judge whether the sentence
+        is finished. May be called from another thread.
+        """
+        stripped = text.strip()
+        if not stripped:
+            return
+        words = stripped.rstrip(".?!,;:").split()
+        if (words and words[-1].lower() in CONTINUATION_WORDS) or stripped.endswith((",", "...", ";", ":")):
+            self.transcript_hint = "continue"
+        elif stripped.endswith((".", "?", "!")):
+            self.transcript_hint = "final"
+
+
+class SpeculativeRequest:
+    """
+    Transcribes the audio recorded so far and sends it to the LLM in the
+    background, before the end of the utterance is confirmed.
+
+    If the user keeps talking the request is cancelled and its result is
+    discarded; the caller starts a fresh one. ``transcribe(audio, cancelled)``
+    is given the cancellation event so a request that was cancelled while
+    waiting for the recogniser can return None without running it. A
+    transcription or LLM request already in progress cannot be aborted, only
+    ignored.
+    """
+    def __init__(self, audio, transcribe, query, on_transcript=None):
+        self.audio = audio
+        self.transcribe = transcribe
+        self.query = query
+        self.on_transcript = on_transcript
+        self.transcript = None
+        self.response = None
+        self.error = None
+        self.cancelled = threading.Event()
+        self.transcribed = threading.Event()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            if self.cancelled.is_set():
+                return
+            result = self.transcribe(self.audio, self.cancelled)
+            if result is None:
+                return
+            self.transcript = result.get("text", "").strip()
+            self.transcribed.set()
+            if self.cancelled.is_set() or not self.transcript:
+                return
+            if self.on_transcript is not None:
+                self.on_transcript(self.transcript)
+            self.response = self.query(self.transcript)
+        except Exception as e:
+            log.error("Speculative request failed: %s", e, exc_info=True)
+            self.error = e
+        finally:
+            self.transcribed.set()
+            self.done.set()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def wait_transcript(self):
+        self.transcribed.wait()
+        return self.transcript
+
+    def wait_response(self):
+        """
+        Returns the LLM response, or None if the request failed or was cancelled.
+        """
+        self.done.wait()
+        if self.cancelled.is_set() or self.error is not None:
+            return None
+        return self.response
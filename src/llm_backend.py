@@ -0,0 +1,178 @@
+import base64
+import os
+import threading
+import time
+
+from openai import OpenAI
+
+from usersettings import user_settings
+from log_setup import get_logger
+
+log = get_logger("llm")
+
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_MAX_TOKENS = 500
+DEFAULT_TIMEOUT = 60.0  # seconds
+HEALTH_CHECK_TIMEOUT = 5.0
+SYSTEM_PROMPT = "You are an assistant that helps troubleshoot projects based on screenshots and questions."
+
+# OpenAI-compatible servers that run on this machine or the LAN. They do not
+# check the API key, but the client refuses to start without one. The OpenAI
+# key is never sent to a custom server; ``llm_api_key`` is used instead.
+LOCAL_PRESETS = {
+    "OpenAI": {"llm_base_url": None, "llm_model": DEFAULT_MODEL, "llm_supports_vision": True},
+    "Ollama": {"llm_base_url": "http://localhost:11434/v1", "llm_model": "llama3.2", "llm_supports_vision": False},
+    "llama.cpp": {"llm_base_url": "http://localhost:8080/v1", "llm_model": "default", "llm_supports_vision": False},
+}
+LOCAL_API_KEY = "not-needed"
+
+
+class LLMBackend:
+    """
+    Chat completion backend for any OpenAI-compatible server.
+
+    The base URL, model, token limit and whether the model accepts images are
+    read from user settings (``llm_base_url``, ``llm_model``,
+    ``llm_max_tokens``, ``llm_supports_vision``). Leaving ``llm_base_url``
+    empty uses the hosted OpenAI API with ``OPENAI_API_KEY``; a custom server
+    gets ``llm_api_key`` or a placeholder.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self.healthy = None  # None until the first health check has run
+        self.reconfigure()
+
+    def reconfigure(self):
+        """
+        Rebuilds the client from the current settings.
+        """
+        with self._lock:
+            self.base_url = user_settings.get("llm_base_url", None) or None
+            self.model = user_settings.get("llm_model", DEFAULT_MODEL)
+            self.max_tokens = user_settings.get("llm_max_tokens", DEFAULT_MAX_TOKENS)
+            self.supports_vision = user_settings.get("llm_supports_vision", self.base_url is None)
+            try:
+                self._client = create_client(self.base_url, user_settings.get("llm_api_key", None),
+                                             timeout=user_settings.get("llm_timeout", DEFAULT_TIMEOUT))
+            except Exception as e:
+                log.error("Could not create LLM client: %s", e)
+                self._client = None
+            self.healthy = None
+        log.info("LLM backend: %s, model %s", self.base_url or "OpenAI", self.model)
+
+    @property
+    def client(self):
+        with self._lock:
+            return self._client
+
+    def build_messages(self, prompt, screenshot_path=None):
+        user_content = [{"type": "text", "text": prompt}]
+
+        if screenshot_path and not self.supports_vision:
+            log.info("Model %s is text-only; not sending the screenshot.", self.model)
+        elif screenshot_path:
+            with open(screenshot_path, "rb") as image_file:
+                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+            user_content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/png;base64,{base64_image}"
+                }
+            })
+
+        # Text-only servers generally expect a plain string, not content parts
+        if len(user_content) == 1:
+            user_content = prompt
+
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_content}
+        ]
+
+    def complete(self, messages, max_tokens=None):
+        client = self.client
+        if client is None:
+            raise RuntimeError("LLM backend is not configured; set an API key or a local server URL.")
+        response = client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens or self.max_tokens
+        )
+        return response.choices[0].message.content
+
+    def health_check(self):
+        """
+        Checks that the server is reachable and serves the configured model.
+        Returns ``(ok, message)``.
+        """
+        ok, message = check_server(self.client, self.base_url, self.model)
+        self.healthy = ok
+        return ok, message
+
+    def warm_up(self):
+        """
+        Sends a one-token request so local servers load the model into memory
+        before the first real query.
+        """
+        started = time.perf_counter()
+        self.complete([{"role": "user", "content": "Hi"}], max_tokens=1)
+        log.info("LLM warm-up done.", extra={"stage": "llm_warmup", "duration": time.perf_counter() - started})
+
+    def start(self):
+        """
+        Runs the health check and, for local servers, the warm-up in the background.
+        """
+        threading.Thread(target=self._startup, daemon=True).start()
+
+    def _startup(self):
+        ok, message = self.health_check()
+        if not ok:
+            log.error("LLM health check failed: %s", message)
+            return
+        log.info("LLM health check: %s", message)
+        if self.base_url:
+            try:
+                self.warm_up()
+            except Exception as e:
+                log.warning("LLM warm-up failed: %s", e)
+
+
+def create_client(base_url, llm_api_key=None, openai_key=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Creates an OpenAI client for ``base_url`` (None for the hosted API).
+    The OpenAI key (``openai_key``, else the saved one) is only used for the
+    hosted API, so it never reaches a third-party server.
+    """
+    if base_url:
+        api_key = llm_api_key or LOCAL_API_KEY
+    else:
+        api_key = openai_key or user_settings.get("OPENAI_API_KEY", None) or os.environ.get("OPENAI_API_KEY")
+    return OpenAI(api_key=api_key, base_url=base_url, timeout=timeout)
+
+
+def check_server(client, base_url, model):
+    """
+    Checks that the server behind ``client`` is reachable and serves
+    ``model``. Returns ``(ok, message)``.
+    """
+    if client is None:
+        return False, "LLM backend is not configured"
+    try:
+        started = time.perf_counter()
+        client = client.with_options(timeout=HEALTH_CHECK_TIMEOUT, max_retries=0)
+        models = [m.id for m in client.models.list()]
+        elapsed = time.perf_counter() - started
+    except Exception as e:
+        return False, f"Cannot reach {base_url or 'OpenAI'}: {e}"
+
+    # Ollama lists tags such as "llama3.2:latest"; llama.cpp serves a single
+    # model whatever name is requested
+    known = model in models or any(m.split(":")[0] == model for m in models)
+    if models and not known and not (base_url and len(models) == 1):
+        return False, f"Model '{model}' not available; server has: {', '.join(models)}"
+    return True, f"Connected to {base_url or 'OpenAI'} in {elapsed * 1000:.0f} ms"
+
+
+# Singleton instance
+llm_backend = LLMBackend()
@@ -1,6 +1,9 @@
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QProgressBar, QLabel
 import whisper
+from log_setup import get_logger
+
+WHISPER_MODEL_NAME = "base"
 
 class ModelLoaderThread(QThread):
     """
@@ -26,14 +29,12 @@ class ModelLoaderThread(QThread):
                 self.sleep(1)  # Simulate time for each step
 
             # Load the actual Whisper model securely
-            model = whisper.load_model("base")
+            model = whisper.load_model(WHISPER_MODEL_NAME)
             self.progress_update.emit(100, "Model loaded successfully!")
             self.finished_loading.emit(model)
 
         except Exception as e:
-            import logging
-            logging.basicConfig(filename='debug.log', level=logging.DEBUG)
-            logging.error(f"Exception in Whisper model loading: {e}", exc_info=True)
+            get_logger("asr").error("Exception in Whisper model loading: %s", e, exc_info=True)
             self.finished_loading.emit(None)
             self.progress_update.emit(100, f"Error loading model: {e}")
 
@@ -0,0 +1,141 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+from datetime import datetime
+
+from usersettings import user_settings
+
+LOG_FILE = 'debug.log'
+ROOT_LOGGER_NAME = 'desktop_assistant'
+
+# Subsystems that get their own logger (and their own configurable level)
+SUBSYSTEMS = ('app', 'audio', 'vad', 'asr', 'llm', 'tts', 'ui')
+
+DEFAULT_LEVEL = 'INFO'
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 3
+
+# Extra fields callers may attach with ``extra={...}``; they are written as
+# top-level JSON keys when present.
+STRUCTURED_FIELDS = ('turn_id', 'stage', 'duration')
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as one JSON object per line.
+    """
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = round(value, 4) if isinstance(value, float) else value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for an in-process queue that defers formatting to the
+    listener thread.
+
+    The stock ``prepare`` formats the record, traceback included, on the
+    calling thread and folds the traceback into the message. Here only the
+    message arguments are resolved (they may change after the call); the
+    exception info is passed through so JsonFormatter writes it as a separate
+    field, and formatting it costs the audio and response threads nothing.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener = None
+
+
+def setup_logging():
+    """
+    Configures application-wide logging.
+
+    Every logger writes into an in-memory queue through a QueueHandler, and a
+    single QueueListener thread drains it into a size-rotated JSON log file,
+    so audio and response threads never block on disk I/O. Safe to call more
+    than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE,
+        maxBytes=user_settings.get("log_max_bytes", DEFAULT_MAX_BYTES),
+        backupCount=user_settings.get("log_backup_count", DEFAULT_BACKUP_COUNT),
+        encoding='utf-8',
+        delay=True,
+    )
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.addHandler(DeferredQueueHandler(log_queue))
+    # Third-party libraries only get through at WARNING and above
+    root.setLevel(logging.WARNING)
+
+    apply_log_levels()
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def apply_log_levels():
+    """
+    Applies the per-subsystem levels from user settings.
+
+    ``log_levels`` maps a subsystem name (or ``"default"``) to a level name,
+    e.g. ``{"default": "INFO", "audio": "DEBUG"}``.
+    """
+    levels = user_settings.get("log_levels", {}) or {}
+    default = levels.get("default", DEFAULT_LEVEL)
+    logging.getLogger(ROOT_LOGGER_NAME).setLevel(_to_level(default))
+    for subsystem in SUBSYSTEMS:
+        level = levels.get(subsystem)
+        logging.getLogger(f"{ROOT_LOGGER_NAME}.{subsystem}").setLevel(
+            _to_level(level) if level else logging.NOTSET
+        )
+
+
+def _to_level(name):
+    level = logging.getLevelName(str(name).upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def get_logger(subsystem):
+    """
+    Returns the logger for one of the application's subsystems.
+    """
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{subsystem}")
+
+
+def shutdown_logging():
+    """
+    Flushes any queued records and stops the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -4,6 +4,18 @@ import tempfile
 import psutil
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QMessageBox
+from log_setup import setup_logging, shutdown_logging, get_logger
+from compute_scheduler import compute_scheduler
+
+# Must run before main_window is imported: it starts loading the TTS model on
+# import, and torch only accepts the inter-op thread count before its first
+# parallel operation.
+setup_logging()
+compute_scheduler.configure_process()
+
+from audio_devices import audio_device_manager
+from llm_backend import llm_backend
+from conversation_store import conversation_store
 from main_window import MainWindow
 from loading_screen import LoadingScreen, ModelLoaderThread
 
@@ -84,24 +96,25 @@ class AppManager:
         """
         self.loading_screen.show()
         self.model_loader_thread.start()
+        llm_backend.start()  # Health check and warm-up run while Whisper loads
+        conversation_store.prune()
         self.app.exec_()
 
     def on_model_loaded(self, model):
         """
         Handles the completion of model loading.
         """
-        import logging
-        logging.basicConfig(filename='debug.log', level=logging.DEBUG)
+        log = get_logger("app")
         self.loading_screen.close()
         if model is not None:
-            logging.debug("Model loaded successfully, showing main window.")
+            log.info("Model loaded successfully, showing main window.")
             self.main_window = MainWindow(model)
             # Call set_central_widget to link the main_window's central_widget
             from main_window import set_central_widget
             set_central_widget(self.main_window.central_widget)
             self.main_window.show()
         else:
-            logging.error("Model is None. Showing error window.")
+            log.error("Model is None. Showing error window.")
             error_message = QLabel("Failed to load the Whisper model. Please try again later.")
             error_message.setAlignment(Qt.AlignCenter)
             error_window = QMainWindow()
@@ -127,6 +140,9 @@ if __name__ == "__main__":
         manager = AppManager()
         app = manager.app # Use manager's QApplication instance
         app.aboutToQuit.connect(single_instance.release_lock) # Ensure lock released cleanly
+        app.aboutToQuit.connect(audio_device_manager.shutdown) # Release PortAudio
+        app.aboutToQuit.connect(conversation_store.close) # Write pending turns
+        app.aboutToQuit.connect(shutdown_logging) # Flush queued log records
         manager.start()
     except Exception as e:
         single_instance.release_lock() # Ensure lock is released even on startup exception
@@ -1,33 +1,53 @@
-import logging
 import threading
-import base64
 import tempfile
 import os
-logging.basicConfig(filename='debug.log', level=logging.ERROR)
+import itertools
+import time
 from usersettings import user_settings
+from log_setup import get_logger
+from model_manager import model_manager, torch_module_bytes
+from compute_scheduler import compute_scheduler
+from audio_devices import audio_device_manager
+from llm_backend import llm_backend, create_client, check_server, LOCAL_PRESETS, DEFAULT_MODEL
+from loading_screen import WHISPER_MODEL_NAME
+from vad_gate import SpeechDetector
+from audio_preprocessing import AudioPreprocessor
+from conversation_store import conversation_store
+from echo_suppression import echo_reference, resample_for_reference, EchoSuppressor, BargeInDetector
+from endpointing import EndpointDetector, SpeculativeRequest, SPECULATE, END
 from dotenv import load_dotenv
 load_dotenv()  # Load environment variables from .env
 import webbrowser
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QAbstractListModel, QModelIndex
 from PyQt5.QtGui import QPainter, QColor, QBrush, QIcon
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QSystemTrayIcon,
-    QMenu, QAction, QDialog, QLabel, QLineEdit, QHBoxLayout, QComboBox, QTextEdit, QProgressBar
+    QMenu, QAction, QDialog, QLabel, QLineEdit, QHBoxLayout, QComboBox, QTextEdit, QProgressBar,
+    QSpinBox, QCheckBox, QListView, QFileDialog
 )
 from PyQt5.QtMultimedia import QAudioProbe, QAudioBuffer
 from PIL import ImageGrab
 from datetime import datetime
-from openai import OpenAI
 import whisper
 import pyaudio
-import wave
 import torch
 import numpy as np
 import silero_vad
 from PyQt5.QtCore import QObject, pyqtSignal
 import soundfile as sf
-import sounddevice as sd
 import contextlib
+import collections
+
+VAD_FRAME_SIZE = 512  # 32 ms at 16 kHz, the frame size Silero VAD expects
+PRE_ROLL_FRAMES = 10  # Frames kept from before speech onset
+HISTORY_UI_LIMIT = 200  # Turns kept in the history list
+HISTORY_SEARCH_DELAY_MS = 250  # Typing pause before the history search runs
+
+ui_log = get_logger("ui")
+audio_log = get_logger("audio")
+asr_log = get_logger("asr")
+llm_log = get_logger("llm")
+tts_log = get_logger("tts")
 
 class RedirectStdout(QObject):
     text_written = pyqtSignal(str)
@@ -38,8 +58,15 @@ class RedirectStdout(QObject):
     def flush(self):
         pass
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+TTS_MODEL_NAME = "tts_models/en/ljspeech/tacotron2-DDC"
+
+
+def _tts_model_bytes(tts):
+    """Size of the Coqui synthesizer's acoustic model and vocoder."""
+    synthesizer = getattr(tts, "synthesizer", None)
+    modules = [getattr(synthesizer, "tts_model", None), getattr(synthesizer, "vocoder_model", None)]
+    return torch_module_bytes([module for module in modules if module is not None])
+
 
 # Initialize Coqui TTS
 class TTSManager(QObject):
@@ -48,78 +75,94 @@ class TTSManager(QObject):
 
     def __init__(self):
         super().__init__()
-        self.tts = None
         self.interrupt_speech = threading.Event()
+        self.playing = threading.Event()
         self.tts_lock = threading.Lock()
         self.initialized = False
         self.stdout_redirector = RedirectStdout()
         self.initialization_thread = threading.Thread(target=self._initialize_tts_thread, daemon=True)
         self.initialization_thread.start()
 
+    def _load_tts(self):
+        """Load the Coqui TTS model; also used by the model manager to reload it after eviction."""
+        from TTS.api import TTS
+        with contextlib.redirect_stdout(self.stdout_redirector):
+            return TTS(model_name=TTS_MODEL_NAME, progress_bar=True)
+
     def _initialize_tts_thread(self):
         """Initialize Coqui TTS in a background thread"""
         self.tts_initialization_started.emit()
         try:
-            from TTS.api import TTS
-            with contextlib.redirect_stdout(self.stdout_redirector):
-                self.tts = TTS(model_name="tts_models/en/ljspeech/tacotron2-DDC", progress_bar=True)
+            model_manager.register("tts", loader=self._load_tts, instance=self._load_tts(), measure=_tts_model_bytes)
             self.initialized = True
-            logging.info("Coqui TTS initialized successfully")
+            tts_log.info("Coqui TTS initialized successfully")
             self.tts_initialized.emit(True)
         except Exception as e:
-            logging.error(f"Failed to initialize Coqui TTS: {e}")
-            self.tts = None
+            tts_log.error("Failed to initialize Coqui TTS: %s", e, exc_info=True)
             self.initialized = False
             self.tts_initialized.emit(False)
 
     def speak(self, text):
-        if not self.initialized or self.tts is None:
-            logging.error("Coqui TTS not initialized, skipping speech.")
+        if not self.initialized:
+            tts_log.error("Coqui TTS not initialized, skipping speech.")
             return
 
         with self.tts_lock:
             self.interrupt_speech.clear()
             try:
-                self._speak_coqui(text)
+                with model_manager.use("tts") as tts:
+                    self._speak_coqui(tts, text)
             except Exception as e:
-                logging.error(f"Error during TTS playback: {e}")
+                tts_log.error("Error during TTS playback: %s", e, exc_info=True)
 
-    def _speak_coqui(self, text):
+    def _speak_coqui(self, tts, text):
         """Use Coqui TTS for speech synthesis and handle interruptions."""
         try:
             with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
                 tmp_path = tmp_file.name
             
-            self.tts.tts_to_file(text=text, file_path=tmp_path)
+            with compute_scheduler.stage("tts"):
+                tts.tts_to_file(text=text, file_path=tmp_path)
             
-            data, samplerate = sf.read(tmp_path)
+            data, samplerate = sf.read(tmp_path, dtype='float32')
+            # What the microphone will hear back, for echo suppression
+            reference = resample_for_reference(data, samplerate)
             
-            device_index = user_settings.get("audio_output_device_index", None)
-
-            # Play audio in chunks to allow for interruption
-            chunk_size = 1024
-            start_pos = 0
-            while start_pos < len(data) and not self.interrupt_speech.is_set():
-                end_pos = start_pos + chunk_size
-                chunk = data[start_pos:end_pos]
-                if device_index is not None:
-                    sd.play(chunk, samplerate, device=device_index)
-                else:
-                    sd.play(chunk, samplerate)
-                sd.wait()
-                start_pos = end_pos
+            # Playback shares the capture PortAudio instance, so device indices agree
+            with audio_device_manager.session() as audio:
+                device = audio_device_manager.resolve_output(user_settings.get("audio_output_device_index", None),
+                                                             user_settings.get("audio_output_device_name", None))
+                device_index = device.index if device is not None else None
+                channels = 1 if data.ndim == 1 else data.shape[1]
+                stream = audio.open(format=pyaudio.paFloat32, channels=channels, rate=samplerate,
+                                    output=True, output_device_index=device_index)
+
+                # Play audio in chunks to allow for interruption
+                chunk_size = 1024
+                start_pos = 0
+                self.playing.set()
+                try:
+                    while start_pos < len(data) and not self.interrupt_speech.is_set():
+                        end_pos = start_pos + chunk_size
+                        echo_reference.push(reference[start_pos * 16000 // samplerate:end_pos * 16000 // samplerate])
+                        stream.write(np.ascontiguousarray(data[start_pos:end_pos]).tobytes())
+                        start_pos = end_pos
+                finally:
+                    self.playing.clear()
+                    stream.stop_stream()
+                    stream.close()
 
             if self.interrupt_speech.is_set():
-                logging.info("TTS playback interrupted.")
-                sd.stop()
+                tts_log.info("TTS playback interrupted.")
 
             os.unlink(tmp_path)
 
         except Exception as e:
-            logging.error(f"Coqui TTS playback error: {e}")
+            self.playing.clear()
+            tts_log.error("Coqui TTS playback error: %s", e, exc_info=True)
 
     def stop_speaking(self):
-        """Stop current TTS playback"""
+        """Stop current TTS playback; the chunk being written (about 50 ms) still plays out."""
         self.interrupt_speech.set()
 
 # Initialize TTS manager
@@ -136,39 +179,18 @@ def capture_screenshot():
 # Function to interact with ChatGPT
 def query_chatgpt(prompt, screenshot_path=None):
     """
-    Queries ChatGPT with a prompt and an optional screenshot.
+    Queries the configured LLM backend with a prompt and an optional screenshot.
     """
-    user_content = [{"type": "text", "text": prompt}]
-
-    if screenshot_path:
-        try:
-            with open(screenshot_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            user_content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/png;base64,{base64_image}"
-                }
-            })
-        except Exception as e:
-            logging.error(f"Error processing screenshot: {e}", exc_info=True)
-            return f"Error processing screenshot: {e}"
-
-    messages = [
-        {"role": "system", "content": "You are an assistant that helps troubleshoot projects based on screenshots and questions."},
-        {"role": "user", "content": user_content}
-    ]
+    try:
+        messages = llm_backend.build_messages(prompt, screenshot_path)
+    except Exception as e:
+        llm_log.error("Error processing screenshot: %s", e, exc_info=True)
+        return f"Error processing screenshot: {e}"
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            max_tokens=500
-        )
-        return response.choices[0].message.content
+        return llm_backend.complete(messages)
     except Exception as e:
-        logging.error(f"Error querying ChatGPT: {e}", exc_info=True)
+        llm_log.error("Error querying ChatGPT: %s", e, exc_info=True)
         return f"Error querying ChatGPT: {e}"
 
 # Global reference to the central widget for AI voice activity
@@ -205,7 +227,7 @@ class MainWindow(QMainWindow):
     def __init__(self, model):
         super().__init__()
         self.setWindowTitle("AI Assistant with Whisper")
-        self.setFixedSize(600, 600)
+        self.setFixedSize(600, 760)
 
         # Set up the central widget with the Whisper model
         self.central_widget = CentralWidget(model)
@@ -216,6 +238,9 @@ class MainWindow(QMainWindow):
         self.settings_action.triggered.connect(self.open_settings)
         self.menu_bar = self.menuBar()
         self.menu_bar.addAction(self.settings_action)
+        self.export_history_action = QAction("Export History", self)
+        self.export_history_action.triggered.connect(self.export_history)
+        self.menu_bar.addAction(self.export_history_action)
 
         # System tray integration
         self.tray_icon = QSystemTrayIcon(self)
@@ -242,20 +267,81 @@ class MainWindow(QMainWindow):
         settings_dialog = SettingsDialog(self)
         settings_dialog.exec_()
 
+    def export_history(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export History", "conversation_history.jsonl",
+                                              "JSON Lines (*.jsonl)")
+        if path:
+            count = conversation_store.export(path)
+            self.tray_icon.showMessage("AI Assistant", f"Exported {count} turns.")
+
+class HistoryModel(QAbstractListModel):
+    """
+    List model holding at most ``limit`` turns; the oldest rows are dropped
+    as new ones arrive, so long sessions do not grow the UI.
+    """
+    def __init__(self, limit=HISTORY_UI_LIMIT, parent=None):
+        super().__init__(parent)
+        self.limit = limit
+        self.turns = collections.deque()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.turns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        turn = self.turns[index.row()]
+        if role == Qt.DisplayRole:
+            when = datetime.fromtimestamp(turn["created_at"]).strftime("%H:%M")
+            response = (turn.get("response") or "").replace("\n", " ")
+            return f"[{when}] You: {turn['transcript']}  |  AI: {response}"
+        if role == Qt.ToolTipRole:
+            return f"You: {turn['transcript']}\n\nAI: {turn.get('response') or ''}"
+        return None
+
+    def set_turns(self, turns):
+        self.beginResetModel()
+        self.turns = collections.deque(list(turns)[-self.limit:])
+        self.endResetModel()
+
+    def append_turn(self, turn):
+        if len(self.turns) >= self.limit:
+            self.beginRemoveRows(QModelIndex(), 0, 0)
+            self.turns.popleft()
+            self.endRemoveRows()
+        row = len(self.turns)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.turns.append(turn)
+        self.endInsertRows()
+
 class CentralWidget(QWidget):
     voice_activity_updated = pyqtSignal(float)
     transcription_updated = pyqtSignal(str)
+    turn_completed = pyqtSignal(dict)
 
     def __init__(self, model):
         super().__init__()
-        self.model = model
         self.is_active = False
         self.is_listening = False  # AI listening state
         self.has_greeted = False  # Tracks whether the greeting has been said
-        self.whisper_model = model  # Use the loaded model passed from MainWindow
         self.speaking = False
         self.ai_speaking = False
-        self.vad_model, self.vad_utils = torch.hub.load(repo_or_dir='snakers4/silero-vad', model='silero_vad', trust_repo=True)
+        self.turn_counter = itertools.count(1)  # Turn IDs for structured log records
+        # The Whisper model is handed to the model manager so it can be evicted
+        # while idle; no reference is kept here. Only the VAD stays resident.
+        model_manager.register("whisper", loader=lambda: whisper.load_model(WHISPER_MODEL_NAME), instance=model)
+        model_manager.register("vad", loader=lambda: torch.hub.load(
+            repo_or_dir='snakers4/silero-vad', model='silero_vad', trust_repo=True), resident=True)
+        self.vad_model, self.vad_utils = model_manager.acquire("vad")
+        self.speech_detector = SpeechDetector(self.vad_model, frame_size=VAD_FRAME_SIZE)
+        self.endpointer = EndpointDetector(frame_duration=VAD_FRAME_SIZE / 16000)
+        self.full_duplex = user_settings.get("full_duplex", True)
+        self.echo_suppressor = EchoSuppressor(echo_reference, VAD_FRAME_SIZE)
+        self.barge_in = BargeInDetector()
+        self.barged_in = False  # Whether the current utterance interrupted playback
+        self.speculation = None  # In-flight SpeculativeRequest for the current utterance
+        self.utterance_duration = None  # Seconds from speech onset to end of the last utterance
+        self.asr_lock = threading.Lock()
 
         # Layout
         self.layout = QVBoxLayout()
@@ -290,6 +376,15 @@ class CentralWidget(QWidget):
         self.progress_label.setVisible(False)  # Initially hidden
         self.layout.addWidget(self.progress_label)
 
+        # Memory used by the process and by each model
+        self.memory_label = QLabel(self)
+        self.memory_label.setStyleSheet("color: #888;")
+        self.layout.addWidget(self.memory_label)
+        self.memory_timer = QTimer(self)
+        self.memory_timer.timeout.connect(self.update_memory_label)
+        self.memory_timer.start(5000)
+        self.update_memory_label()
+
         # Voice Activity Visualizers
         activity_layout = QVBoxLayout()
         
@@ -335,17 +430,50 @@ class CentralWidget(QWidget):
         self.layout.addLayout(activity_layout)
 
         # Audio Device Input
+        input_device_layout = QHBoxLayout()
+        input_device_layout.addWidget(QLabel("Microphone:"))
         self.audio_device_combo = QComboBox()
         self.populate_audio_devices()
         self.audio_device_combo.currentIndexChanged.connect(self.save_audio_device)
-        self.layout.addWidget(self.audio_device_combo)
+        input_device_layout.addWidget(self.audio_device_combo, 1)
+        self.layout.addLayout(input_device_layout)
+
+        # Audio Device Output
+        output_device_layout = QHBoxLayout()
+        output_device_layout.addWidget(QLabel("Speaker:"))
+        self.audio_output_device_combo = QComboBox()
+        self.populate_audio_output_devices()
+        self.audio_output_device_combo.currentIndexChanged.connect(self.save_audio_output_device)
+        output_device_layout.addWidget(self.audio_output_device_combo, 1)
+        self.layout.addLayout(output_device_layout)
+        audio_device_manager.devices_changed.connect(self.on_audio_devices_changed)
 
         # Transcription display
         self.transcription_display = QTextEdit()
         self.transcription_display.setReadOnly(True)
+        self.transcription_display.setFixedHeight(60)
         self.layout.addWidget(self.transcription_display)
         self.transcription_updated.connect(self.transcription_display.setText)
 
+        # Conversation history: search box and a bounded, virtualized list
+        self.history_search = QLineEdit()
+        self.history_search.setPlaceholderText("Search conversation history")
+        # Search once typing pauses rather than on every keystroke
+        self.history_search_timer = QTimer(self)
+        self.history_search_timer.setSingleShot(True)
+        self.history_search_timer.setInterval(HISTORY_SEARCH_DELAY_MS)
+        self.history_search_timer.timeout.connect(lambda: self.search_history(self.history_search.text()))
+        self.history_search.textChanged.connect(self.history_search_timer.start)
+        self.layout.addWidget(self.history_search)
+        self.history_model = HistoryModel(limit=user_settings.get("history_ui_limit", HISTORY_UI_LIMIT))
+        self.history_model.set_turns(conversation_store.recent(self.history_model.limit))
+        self.history_view = QListView()
+        self.history_view.setModel(self.history_model)
+        self.history_view.setUniformItemSizes(True)
+        self.history_view.setEditTriggers(QListView.NoEditTriggers)
+        self.layout.addWidget(self.history_view)
+        self.turn_completed.connect(self.on_turn_completed)
+
         # Timer to update voice activity bar
         self.voice_activity_updated.connect(self.set_voice_activity_level)
 
@@ -377,6 +505,22 @@ class CentralWidget(QWidget):
         # Hide the progress label after a few seconds
         QTimer.singleShot(5000, lambda: self.progress_label.setVisible(False))
 
+    def on_turn_completed(self, turn):
+        # Search results stay put; new turns show up once the search is cleared
+        if not self.history_search.text().strip():
+            self.history_model.append_turn(turn)
+            self.history_view.scrollToBottom()
+
+    def search_history(self, text):
+        if text.strip():
+            self.history_model.set_turns(conversation_store.search(text, limit=self.history_model.limit))
+        else:
+            self.history_model.set_turns(conversation_store.recent(self.history_model.limit))
+            self.history_view.scrollToBottom()
+
+    def update_memory_label(self):
+        self.memory_label.setText(model_manager.format_memory_report())
+
     def minimizeToSystemTray(self):
         self.parent().hide()
         self.parent().tray_icon.showMessage("AI Assistant", "Minimized to system tray.")
@@ -400,6 +544,8 @@ class CentralWidget(QWidget):
             self.on_off_button.setText("Start")
             self.status_indicator.setStyleSheet(self.get_indicator_style("grey"))
             stop_speaking()
+            compute_scheduler.log_stats()
+            self.barge_in.log_stats()
             speak("Session ended.")
         else:
             self.is_listening = True
@@ -415,180 +561,318 @@ class CentralWidget(QWidget):
     def start_listening_session(self):
         try:
             while self.is_listening:
-                # Interrupt speech if new input is detected
-                stop_speaking()
+                # Interrupt speech if new input is detected. In full-duplex mode
+                # the capture loop interrupts playback itself when the user talks.
+                if not self.full_duplex:
+                    stop_speaking()
                 # Record audio
-                audio_path = self.record_audio()
-
-                if not audio_path:
-                    logging.error(f"[{datetime.now()}] No audio recorded.")
+                turn_id = next(self.turn_counter)
+                recording = self.record_audio()
+                speculation, self.speculation = self.speculation, None
+                # Speech onset to end of utterance, not the idle wait before it
+                timings = {"record": self.utterance_duration}
+
+                if recording is None:
+                    if self.barged_in:
+                        self.barge_in.report_false_trigger()
+                    if speculation is not None:
+                        speculation.cancel()
+                    audio_log.error("No audio recorded.", extra={"turn_id": turn_id, "stage": "record"})
                     continue  # No audio recorded; refresh the listening loop
+                audio_log.debug("Utterance recorded.", extra={
+                    "turn_id": turn_id, "stage": "record", "duration": timings["record"]})
 
-                # Transcribe audio with Whisper
+                # Transcribe audio with Whisper, unless a speculative request
+                # already transcribed exactly this audio
+                started = time.perf_counter()
                 try:
-                    result = self.whisper_model.transcribe(audio_path)
+                    if speculation is not None and speculation.wait_transcript():
+                        asr_log.debug("Using speculative transcript.", extra={"turn_id": turn_id, "stage": "transcribe"})
+                        result = {"text": speculation.transcript}
+                    else:
+                        speculation = None
+                        result = self.transcribe(recording)
                 except Exception as e:
-                    logging.error(f"[{datetime.now()}] Error during transcription: {e}", exc_info=True)
+                    asr_log.error("Error during transcription: %s", e, exc_info=True,
+                                  extra={"turn_id": turn_id, "stage": "transcribe"})
                     speak(f"Error during transcription: {e}")
                     continue
 
                 query = result.get("text", "").strip()
                 if query:
-                    logging.info(f"[{datetime.now()}] User said: {query}")
+                    timings["transcribe"] = time.perf_counter() - started
+                    asr_log.info("User said: %s", query, extra={
+                        "turn_id": turn_id, "stage": "transcribe", "duration": timings["transcribe"]})
                     self.transcription_updated.emit(query)
                     # Respond in a separate thread so listening can continue
-                    response_thread = threading.Thread(target=self.respond_to_query, args=(query,), daemon=True)
+                    response_thread = threading.Thread(target=self.respond_to_query,
+                                                       args=(query, turn_id, speculation, timings), daemon=True)
                     response_thread.start()
                 else:
-                    logging.warning(f"[{datetime.now()}] No valid transcription.")
+                    if self.barged_in:
+                        self.barge_in.report_false_trigger()
+                    asr_log.warning("No valid transcription.", extra={"turn_id": turn_id, "stage": "transcribe"})
                     continue
 
         except Exception as e:
-            logging.error(f"[{datetime.now()}] Exception in interaction loop: {e}", exc_info=True)
+            ui_log.error("Exception in interaction loop: %s", e, exc_info=True)
             speak(f"An error occurred: {e}")
 
-    def respond_to_query(self, query):
-        import logging
-        from datetime import datetime
+    def transcribe(self, audio, cancelled=None):
+        """
+        Transcribes a float32 array at 16 kHz. Serialized because
+        Whisper installs per-call hooks on the shared model. Returns None
+        without transcribing if the ``cancelled`` event was set while
+        waiting for the lock.
+        """
+        with self.asr_lock:
+            if cancelled is not None and cancelled.is_set():
+                return None
+            with model_manager.use("whisper") as whisper_model, compute_scheduler.stage("asr"):
+                return whisper_model.transcribe(audio)
+
+    def respond_to_query(self, query, turn_id=None, speculation=None, timings=None):
         self.speaking = True
+        timings = dict(timings or {})
+        response = None
         try:
-            response = query_chatgpt(query)
-            logging.info(f"[{datetime.now()}] ChatGPT response: {response}")
+            started = time.perf_counter()
+            response = speculation.wait_response() if speculation is not None else None
+            if response is not None:
+                llm_log.debug("Using speculative response.", extra={"turn_id": turn_id, "stage": "llm"})
+            else:
+                response = query_chatgpt(query)
+            timings["llm"] = time.perf_counter() - started
+            llm_log.info("ChatGPT response: %s", response, extra={
+                "turn_id": turn_id, "stage": "llm", "duration": timings["llm"]})
+            started = time.perf_counter()
             speak(response)
+            timings["tts"] = time.perf_counter() - started
+            tts_log.debug("Response spoken.", extra={
+                "turn_id": turn_id, "stage": "tts", "duration": timings["tts"]})
             self.transcription_updated.emit("")
         except Exception as e:
-            logging.error(f"[{datetime.now()}] Error querying ChatGPT: {e}", exc_info=True)
+            llm_log.error("Error querying ChatGPT: %s", e, exc_info=True, extra={"turn_id": turn_id, "stage": "llm"})
             speak(f"Error querying ChatGPT: {e}")
         self.speaking = False
+        conversation_store.record_turn(query, response, turn_id=turn_id, timings=timings)
+        self.turn_completed.emit({"transcript": query, "response": response, "created_at": time.time()})
 
-    def record_audio(self, silence_timeout=2.0):
+    def record_audio(self):
         """
         Records audio from the microphone using VAD to detect speech.
-        Recording starts when speech is detected and stops after a period of silence.
+        Recording starts when speech is detected and stops when the endpoint
+        detector decides the utterance is over. At the first short pause a
+        speculative request is started and left in ``self.speculation``.
+
+        Returns the utterance as a float32 array at 16 kHz, or None.
         """
         try:
-            chunk = 512
-            sample_format = pyaudio.paInt16
-            channels = 1
-            rate = 16000
-            temp_audio_file = "temp_audio.wav"
-
-            audio = pyaudio.PyAudio()
-            device_index = user_settings.get("audio_device_index", None)
+            # VAD runs on this thread; keep it on its reserved core
+            compute_scheduler.pin_realtime("vad")
+            # Pending device rescans run between utterances, outside the session
+            with audio_device_manager.session() as audio:
+                return self._record_utterance(audio)
+        except Exception as e:
+            audio_log.error("Error recording audio: %s", e, exc_info=True)
+            speak(f"Error recording audio: {e}")
+            return None
 
-            # Validate the device index
-            if device_index is not None:
-                try:
-                    device_info = audio.get_device_info_by_index(device_index)
-                    if device_info['maxInputChannels'] == 0:
-                        logging.warning(f"Device at index {device_index} is not an input device. Falling back to default.")
-                        device_index = None
-                except OSError:
-                    logging.warning(f"Invalid device index {device_index}. Falling back to default.")
-                    device_index = None
-
-            stream = audio.open(format=sample_format, channels=channels,
-                                  rate=rate, input=True, frames_per_buffer=chunk,
-                                  input_device_index=device_index)
-
-            logging.info("Listening for speech...")
-            frames = []
-            is_speaking = False
-            silence_chunks = 0
-            max_silence_chunks = int(silence_timeout * rate / chunk)
+    def _record_utterance(self, audio):
+        """Body of ``record_audio``, run inside an audio device session."""
+        device = audio_device_manager.resolve_input(user_settings.get("audio_device_index", None),
+                                                    user_settings.get("audio_device_name", None))
+        device_index = device.index if device is not None else None
 
-            while self.is_listening:
-                try:
-                    data = stream.read(chunk)
-                except IOError:
-                    # An IOError will be raised when the stream is closed from another thread
-                    # We can safely break the loop and clean up.
-                    break
-                
-                audio_chunk_tensor = torch.from_numpy(np.frombuffer(data, dtype=np.int16).copy()).float() / 32768.0
-                speech_prob = self.vad_model(audio_chunk_tensor, rate).item()
-                self.voice_activity_updated.emit(speech_prob)
+        try:
+            stream, chunk, preprocessor = self.open_input_stream(audio, device)
+        except (IOError, OSError):
+            if device_index is None:
+                raise
+            # The device disappeared since the last scan; fail over to the default
+            audio_device_manager.report_failure(device_index)
+            device_index = None
+            stream, chunk, preprocessor = self.open_input_stream(audio, None)
+
+        audio_log.info("Listening for speech...")
+        self.utterance_duration = None
+        speech_started = None
+        frames = []
+        pre_roll = collections.deque(maxlen=PRE_ROLL_FRAMES)
+        is_speaking = False
+        finished = False
+        self.barged_in = False
+        self.barge_in.reset()
+
+        while self.is_listening and not finished:
+            if not is_speaking and audio_device_manager.restart_pending:
+                # Devices changed; end this idle session so PortAudio can be re-initialised
+                audio_log.info("Restarting capture after an audio device change.")
+                break
+            try:
+                data = stream.read(chunk, exception_on_overflow=False)
+            except IOError:
+                # An IOError will be raised when the stream is closed from another thread
+                # or the device is unplugged. We can safely break the loop and clean up.
+                if self.is_listening:
+                    audio_device_manager.report_failure(device_index)
+                break
+
+            read_time = time.monotonic()
+            block_frames = preprocessor.process(data)
+            for i, frame in enumerate(block_frames):
+                playback = self.full_duplex and echo_reference.active()
+                if playback:
+                    # Approximate capture time of the frame's last sample
+                    frame_end = read_time - ((len(block_frames) - 1 - i) * VAD_FRAME_SIZE
+                                             + preprocessor.buffered) / 16000
+                    frame = self.echo_suppressor.process(frame, frame_end)
+
+                speech_prob = self.speech_detector.process(frame, force=is_speaking)
+                self.voice_activity_updated.emit(max(speech_prob, self.speech_detector.level))
+
+                if playback and not is_speaking:
+                    if self.barge_in.update(speech_prob, self.echo_suppressor.residual_ratio,
+                                            echo_converged=self.echo_suppressor.converged):
+                        audio_log.info("Barge-in detected, stopping playback.")
+                        stop_speaking()
+                        self.barged_in = True
+                    else:
+                        # Speech during playback only starts a turn once it
+                        # is confirmed as the user and not residual echo
+                        pre_roll.append(frame)
+                        continue
 
                 if speech_prob > 0.5:
                     if not is_speaking:
-                        logging.info("Speech detected, recording...")
+                        audio_log.info("Speech detected, recording...")
+                        # Bring evicted models back while the user is still talking
+                        model_manager.preload("whisper", "tts")
                         is_speaking = True
-                        frames = [] # Start with a clean slate
-                    frames.append(data)
-                    silence_chunks = 0
+                        speech_started = time.perf_counter()
+                        self.endpointer.start_utterance()
+                        # Start with the frames just before onset, which the gate may have held back
+                        frames = list(pre_roll)
+                    elif self.speculation is not None:
+                        # The user kept talking; the speculative request is stale
+                        self.speculation.cancel()
+                        self.speculation = None
+                    frames.append(frame)
+                    self.endpointer.update(speech_prob)
                 elif is_speaking:
-                    silence_chunks += 1
-                    if silence_chunks > max_silence_chunks:
-                        logging.info("Silence detected, stopping recording.")
+                    decision = self.endpointer.update(speech_prob)
+                    if decision == END:
+                        audio_log.info("End of utterance detected, stopping recording.")
+                        finished = True
                         break
-            
-            stream.stop_stream()
-            stream.close()
-            audio.terminate()
-
-            if not frames:
-                return None
+                    if decision == SPECULATE and user_settings.get("speculative_dispatch", True):
+                        self.speculation = SpeculativeRequest(np.concatenate(frames), self.transcribe,
+                                                              query_chatgpt,
+                                                              on_transcript=self.endpointer.set_partial_transcript)
+                else:
+                    pre_roll.append(frame)
 
-            with wave.open(temp_audio_file, 'wb') as wf:
-                wf.setnchannels(channels)
-                wf.setsampwidth(audio.get_sample_size(sample_format))
-                wf.setframerate(rate)
-                wf.writeframes(b''.join(frames))
+        if speech_started is not None:
+            self.utterance_duration = time.perf_counter() - speech_started
+        stream.stop_stream()
+        stream.close()
 
-            return temp_audio_file
-        except Exception as e:
-            logging.error(f"Error recording audio: {e}", exc_info=True)
-            speak(f"Error recording audio: {e}")
+        if not frames:
             return None
+        return np.concatenate(frames)
+
+    def open_input_stream(self, audio, device):
+        """
+        Opens a capture stream at the device's native rate and channel count
+        (or 16 kHz mono when native capture is disabled or unsupported) and
+        returns it with its block size and the preprocessor that converts its
+        blocks for the VAD.
+        """
+        if device is None:
+            device = audio_device_manager.default_input()
+        device_index = device.index if device is not None else None
+
+        formats = [(16000, 1)]
+        if device is not None and user_settings.get("audio_native_capture", True):
+            native = (device.native_input_rate, min(device.max_input_channels, 2))
+            if native != formats[0]:
+                formats.insert(0, native)
+
+        for i, (rate, channels) in enumerate(formats):
+            # Read roughly one VAD frame's worth of audio per block
+            chunk = int(round(VAD_FRAME_SIZE * rate / 16000))
+            try:
+                stream = audio.open(format=pyaudio.paInt16, channels=channels,
+                                    rate=rate, input=True, frames_per_buffer=chunk,
+                                    input_device_index=device_index)
+            except (IOError, OSError, ValueError):
+                if i == len(formats) - 1:
+                    raise
+                audio_log.warning("Could not open device %s at %d Hz x%d, trying 16 kHz mono.",
+                                  device_index, rate, channels)
+                continue
+            audio_log.info("Capturing at %d Hz x%d.", rate, channels)
+            preprocessor = AudioPreprocessor(rate, channels, VAD_FRAME_SIZE,
+                                             highpass_hz=user_settings.get("audio_highpass_hz", None),
+                                             noise_suppression=user_settings.get("audio_noise_suppression", False))
+            return stream, chunk, preprocessor
 
     def remind_user(self):
         if self.is_listening:
             speak("I am still here and listening if you need help.")
 
     def populate_audio_devices(self):
-        audio = pyaudio.PyAudio()
-        for i in range(audio.get_device_count()):
-            dev = audio.get_device_info_by_index(i)
-            if dev['maxInputChannels'] > 0:
-                self.audio_device_combo.addItem(dev['name'], i)
-        
-        current_device_index = user_settings.get("audio_device_index", None)
-        if current_device_index is not None:
-            index_to_set = self.audio_device_combo.findData(current_device_index)
-            if index_to_set != -1:
-                self.audio_device_combo.setCurrentIndex(index_to_set)
-            else:
-                logging.warning(f"Saved audio device with index {current_device_index} not found.")
-                if self.audio_device_combo.count() > 0:
-                    self.audio_device_combo.setCurrentIndex(0)
-                    self.save_audio_device()
+        self._populate_device_combo(self.audio_device_combo, audio_device_manager.devices(input=True),
+                                    "audio_device_index", "audio_device_name", self.save_audio_device)
 
     def save_audio_device(self):
-        device_index = self.audio_device_combo.currentData()
-        user_settings.set("audio_device_index", device_index)
+        user_settings.set("audio_device_index", self.audio_device_combo.currentData())
+        user_settings.set("audio_device_name", self.audio_device_combo.currentText())
 
     def populate_audio_output_devices(self):
-        audio = pyaudio.PyAudio()
-        for i in range(audio.get_device_count()):
-            dev = audio.get_device_info_by_index(i)
-            if dev['maxOutputChannels'] > 0:
-                self.audio_output_device_combo.addItem(dev['name'], i)
-        
-        current_device_index = user_settings.get("audio_output_device_index", None)
-        if current_device_index is not None:
-            index_to_set = self.audio_output_device_combo.findData(current_device_index)
-            if index_to_set != -1:
-                self.audio_output_device_combo.setCurrentIndex(index_to_set)
-            else:
-                logging.warning(f"Saved audio output device with index {current_device_index} not found.")
-                if self.audio_output_device_combo.count() > 0:
-                    self.audio_output_device_combo.setCurrentIndex(0)
-                    self.save_audio_output_device()
+        self._populate_device_combo(self.audio_output_device_combo, audio_device_manager.devices(output=True),
+                                    "audio_output_device_index", "audio_output_device_name",
+                                    self.save_audio_output_device)
 
     def save_audio_output_device(self):
-        device_index = self.audio_output_device_combo.currentData()
-        user_settings.set("audio_output_device_index", device_index)
-
+        user_settings.set("audio_output_device_index", self.audio_output_device_combo.currentData())
+        user_settings.set("audio_output_device_name", self.audio_output_device_combo.currentText())
+
+    def _populate_device_combo(self, combo, devices, index_key, name_key, save):
+        """Fill a device combo from the cached device list and select the saved device."""
+        combo.blockSignals(True)
+        combo.clear()
+        for device in devices:
+            combo.addItem(device.name, device.index)
+        combo.blockSignals(False)
+
+        current_device_index = user_settings.get(index_key, None)
+        current_device_name = user_settings.get(name_key, None)
+        if current_device_index is None and current_device_name is None:
+            return
+        index_to_set = combo.findData(current_device_index)
+        if current_device_name is not None and combo.itemText(index_to_set) != current_device_name:
+            # Indices shift when devices are plugged in or removed
+            index_to_set = combo.findText(current_device_name)
+        if index_to_set != -1:
+            combo.blockSignals(True)
+            combo.setCurrentIndex(index_to_set)
+            combo.blockSignals(False)
+            # Also save when only the index was stored (older configs), so the
+            # name is there to find the device after indices shift
+            if combo.currentData() != current_device_index or current_device_name is None:
+                save()
+        else:
+            ui_log.warning("Saved audio device %s (%s) not found.", current_device_index, current_device_name)
+            # Keep the saved choice so the device is picked again when it comes back
+            if combo.count() > 0:
+                combo.blockSignals(True)
+                combo.setCurrentIndex(0)
+                combo.blockSignals(False)
+
+    def on_audio_devices_changed(self):
+        self.populate_audio_devices()
+        self.populate_audio_output_devices()
 
     def get_indicator_style(self, color):
         return f"""
@@ -606,10 +890,12 @@ class CentralWidget(QWidget):
 
 # Settings Dialog Class
 class SettingsDialog(QDialog):
+    connection_tested = pyqtSignal(bool, str)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Settings")
-        self.setFixedSize(400, 200)
+        self.setFixedSize(400, 450)
 
         # Layout
         layout = QVBoxLayout()
@@ -625,22 +911,110 @@ class SettingsDialog(QDialog):
         open_api_url_button = QPushButton("Generate API Key")
         open_api_url_button.clicked.connect(self.open_api_key_url)
 
+        # LLM Backend
+        backend_label = QLabel("LLM Backend:")
+        self.backend_preset_combo = QComboBox()
+        self.backend_preset_combo.addItem("Custom")
+        self.backend_preset_combo.addItems(LOCAL_PRESETS.keys())
+        self.backend_preset_combo.currentTextChanged.connect(self.apply_backend_preset)
+        self.base_url_input = QLineEdit()
+        self.base_url_input.setPlaceholderText("Server URL (empty for OpenAI)")
+        self.base_url_input.setText(llm_backend.base_url or "")
+        self.model_input = QLineEdit()
+        self.model_input.setPlaceholderText("Model")
+        self.model_input.setText(llm_backend.model)
+        self.llm_api_key_input = QLineEdit()
+        self.llm_api_key_input.setPlaceholderText("Server API key (optional, never the OpenAI key)")
+        self.llm_api_key_input.setText(user_settings.get("llm_api_key", None) or "")
+        self.max_tokens_input = QSpinBox()
+        self.max_tokens_input.setRange(16, 32768)
+        self.max_tokens_input.setPrefix("Max tokens: ")
+        self.max_tokens_input.setValue(llm_backend.max_tokens)
+        self.vision_checkbox = QCheckBox("Model accepts screenshots")
+        self.vision_checkbox.setChecked(llm_backend.supports_vision)
+
+        # Test Connection Button
+        self.test_status_label = QLabel("")
+        self.test_status_label.setWordWrap(True)
+        self.test_button = QPushButton("Test Connection")
+        self.test_button.clicked.connect(self.test_connection)
+        self.connection_tested.connect(self.show_connection_result)
+
         # Save Button
         save_button = QPushButton("Save")
-        save_button.clicked.connect(self.save_api_key)
+        save_button.clicked.connect(self.save_settings)
 
 
         # Add widgets to layout
         layout.addWidget(api_key_label)
         layout.addWidget(self.api_key_input)
         layout.addWidget(open_api_url_button)
+        layout.addWidget(backend_label)
+        layout.addWidget(self.backend_preset_combo)
+        layout.addWidget(self.base_url_input)
+        layout.addWidget(self.model_input)
+        layout.addWidget(self.llm_api_key_input)
+        layout.addWidget(self.max_tokens_input)
+        layout.addWidget(self.vision_checkbox)
+        layout.addWidget(self.test_button)
+        layout.addWidget(self.test_status_label)
         layout.addWidget(save_button)
 
     def open_api_key_url(self):
         webbrowser.open("https://platform.openai.com/account/api-keys")
 
-    def save_api_key(self):
+    def apply_backend_preset(self, name):
+        preset = LOCAL_PRESETS.get(name)
+        if preset is None:
+            return
+        self.base_url_input.setText(preset["llm_base_url"] or "")
+        self.model_input.setText(preset["llm_model"])
+        self.vision_checkbox.setChecked(preset["llm_supports_vision"])
+
+    def store_settings(self):
         new_key = self.api_key_input.text().strip()
         user_settings.set("OPENAI_API_KEY", new_key)
         os.environ["OPENAI_API_KEY"] = new_key
-        self.close()
\ No newline at end of file
+        user_settings.set("llm_base_url", self.base_url_input.text().strip() or None)
+        user_settings.set("llm_api_key", self.llm_api_key_input.text().strip() or None)
+        user_settings.set("llm_model", self.model_input.text().strip() or DEFAULT_MODEL)
+        user_settings.set("llm_max_tokens", self.max_tokens_input.value())
+        user_settings.set("llm_supports_vision", self.vision_checkbox.isChecked())
+        llm_backend.reconfigure()
+
+    def test_connection(self):
+        """
+        Checks the values currently in the dialog, without saving them, on a
+        background thread so the dialog stays responsive.
+        """
+        base_url = self.base_url_input.text().strip() or None
+        model = self.model_input.text().strip() or DEFAULT_MODEL
+        llm_api_key = self.llm_api_key_input.text().strip() or None
+        openai_key = self.api_key_input.text().strip() or None
+        self.test_button.setEnabled(False)
+        self.test_status_label.setStyleSheet("")
+        self.test_status_label.setText("Testing connection...")
+        threading.Thread(target=self._run_connection_test, args=(base_url, model, llm_api_key, openai_key),
+                         daemon=True).start()
+
+    def _run_connection_test(self, base_url, model, llm_api_key, openai_key):
+        try:
+            client = create_client(base_url, llm_api_key, openai_key=openai_key)
+        except Exception as e:
+            ok, message = False, f"Could not create client: {e}"
+        else:
+            ok, message = check_server(client, base_url, model)
+        try:
+            self.connection_tested.emit(ok, message)
+        except RuntimeError:
+            pass  # The dialog was closed before the test finished
+
+    def show_connection_result(self, ok, message):
+        self.test_button.setEnabled(True)
+        self.test_status_label.setText(message)
+        self.test_status_label.setStyleSheet("color: green;" if ok else "color: red;")
+
+    def save_settings(self):
+        self.store_settings()
+        llm_backend.start()
+        self.close()
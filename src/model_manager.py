@@ -0,0 +1,285 @@
+import contextlib
+import gc
+import threading
+import time
+
+import psutil
+import torch
+
+from usersettings import user_settings
+from log_setup import get_logger
+
+log = get_logger("app")
+
+DEFAULT_IDLE_TIMEOUT = 10 * 60  # seconds
+DEFAULT_CHECK_INTERVAL = 30  # seconds
+DEFAULT_MIN_IDLE_FOR_EVICTION = 120  # Models used more recently are kept even over budget
+MIN_FREED_BYTES = 16 * 1024 * 1024  # Less than this counts as nothing freed
+
+
+class _ManagedModel:
+    """
+    Bookkeeping for a single registered model.
+    """
+    def __init__(self, name, loader, resident, idle_timeout, measure):
+        self.name = name
+        self.loader = loader
+        self.resident = resident
+        self.idle_timeout = idle_timeout
+        self.measure = measure
+        self.instance = None
+        self.size_bytes = None
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.lock = threading.RLock()
+        self.loading = None  # Thread running a background preload, if any
+
+
+class ModelManager:
+    """
+    Keeps track of the heavy models, unloads them after a period of inactivity
+    or when the process exceeds its memory budget, and reloads them on demand.
+
+    Resident models (the VAD) are never evicted.
+    """
+    def __init__(self):
+        self._models = {}
+        self._registry_lock = threading.Lock()
+        self._process = psutil.Process()
+        self._unreachable_budget = None  # Budget found unreachable, until RSS is back under it
+        self._stop = threading.Event()
+        self._watchdog = threading.Thread(target=self._watchdog_loop, daemon=True)
+        self._watchdog.start()
+
+    # Configuration is read on every check so changes in the settings file
+    # apply without a restart.
+    @property
+    def idle_timeout(self):
+        return user_settings.get("model_idle_timeout", DEFAULT_IDLE_TIMEOUT)
+
+    @property
+    def memory_budget(self):
+        """RSS budget in bytes, or None when unlimited."""
+        budget_mb = user_settings.get("model_memory_budget_mb", None)
+        return int(budget_mb * 1024 * 1024) if budget_mb else None
+
+    @property
+    def min_idle_for_eviction(self):
+        return user_settings.get("model_min_idle_for_eviction", DEFAULT_MIN_IDLE_FOR_EVICTION)
+
+    def register(self, name, loader, instance=None, resident=False, idle_timeout=None, measure=None):
+        """
+        Registers a model under ``name``.
+
+        ``loader`` is a zero-argument callable returning a fresh instance. An
+        already loaded ``instance`` may be handed over so it is not loaded twice.
+        ``measure`` optionally returns the size in bytes of an instance; by
+        default torch modules are measured by their parameters and buffers.
+        """
+        entry = _ManagedModel(name, loader, resident, idle_timeout, measure)
+        with self._registry_lock:
+            self._models[name] = entry
+        if instance is not None:
+            with entry.lock:
+                entry.instance = instance
+                entry.size_bytes = self._measure(entry, instance)
+                entry.last_used = time.monotonic()
+        return entry
+
+    def is_loaded(self, name):
+        entry = self._models.get(name)
+        return entry is not None and entry.instance is not None
+
+    def acquire(self, name):
+        """
+        Returns the model, loading it first if it has been evicted.
+        """
+        entry = self._models[name]
+        with entry.lock:
+            if entry.instance is None:
+                self._load(entry)
+            entry.last_used = time.monotonic()
+            return entry.instance
+
+    @contextlib.contextmanager
+    def use(self, name):
+        """
+        Context manager that pins the model in memory while it is in use.
+        """
+        entry = self._models[name]
+        with entry.lock:
+            model = self.acquire(name)
+            entry.in_use += 1
+        try:
+            yield model
+        finally:
+            with entry.lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def preload(self, *names):
+        """
+        Starts loading evicted models in the background, e.g. as soon as the
+        user starts speaking, so they are ready by the time they are needed.
+        """
+        for name in names:
+            entry = self._models.get(name)
+            if entry is None or entry.instance is not None:
+                continue
+            if entry.loading is not None and entry.loading.is_alive():
+                continue
+            log.info("Preloading model '%s'.", name)
+            entry.loading = threading.Thread(target=self.acquire, args=(name,), daemon=True)
+            entry.loading.start()
+
+    def touch(self, name):
+        """Marks a model as recently used without loading it."""
+        entry = self._models.get(name)
+        if entry is not None:
+            entry.last_used = time.monotonic()
+
+    def unload(self, name):
+        """
+        Unloads a model unless it is resident or currently in use.
+        Returns True if the model was unloaded.
+        """
+        entry = self._models[name]
+        with entry.lock:
+            if entry.resident or entry.in_use or entry.instance is None:
+                return False
+            entry.instance = None
+        log.info("Unloaded model '%s' (%s).", name, format_bytes(entry.size_bytes))
+        self._release_memory()
+        return True
+
+    def process_rss(self):
+        return self._process.memory_info().rss
+
+    def memory_report(self):
+        """
+        Returns ``{name: size_bytes}`` for every registered model; the size is
+        None for models that are not currently loaded.
+        """
+        with self._registry_lock:
+            entries = list(self._models.values())
+        return {entry.name: (entry.size_bytes if entry.instance is not None else None) for entry in entries}
+
+    def format_memory_report(self):
+        parts = [f"RSS {format_bytes(self.process_rss())}"]
+        for name, size in self.memory_report().items():
+            parts.append(f"{name} {format_bytes(size) if size is not None else 'unloaded'}")
+        return " | ".join(parts)
+
+    def check(self):
+        """
+        Evicts models that have been idle too long, then evicts the least
+        recently used models until the process fits in the memory budget.
+
+        Budget evictions only take models that have been idle for
+        ``min_idle_for_eviction``, and stop as soon as an eviction frees no
+        measurable memory (RSS often does not shrink after unloading, and
+        torch alone may exceed a small budget). The budget is then treated as
+        unreachable and left to the idle timeout until RSS drops under it, so
+        it does not make every turn reload its models.
+        """
+        now = time.monotonic()
+        with self._registry_lock:
+            entries = list(self._models.values())
+
+        for entry in entries:
+            timeout = entry.idle_timeout if entry.idle_timeout is not None else self.idle_timeout
+            if entry.resident or entry.instance is None:
+                continue
+            if timeout and now - entry.last_used > timeout:
+                log.info("Model '%s' idle for %.0f s.", entry.name, now - entry.last_used)
+                self.unload(entry.name)
+
+        budget = self.memory_budget
+        if budget is None:
+            return
+        rss = self.process_rss()
+        if rss <= budget:
+            self._unreachable_budget = None
+            return
+        if self._unreachable_budget == budget:
+            return
+        for entry in sorted(entries, key=lambda e: e.last_used):
+            if rss <= budget:
+                return
+            if entry.instance is None or entry.resident or now - entry.last_used < self.min_idle_for_eviction:
+                continue
+            log.info("Process RSS %s is over the %s budget.", format_bytes(rss), format_bytes(budget))
+            if not self.unload(entry.name):
+                continue
+            freed = rss - self.process_rss()
+            rss -= freed
+            if freed < MIN_FREED_BYTES:
+                self._unreachable_budget = budget
+                break
+        if self._unreachable_budget == budget:
+            log.warning("Memory budget %s cannot be met (RSS %s after evicting); "
+                        "leaving models to the idle timeout until RSS is back under budget.",
+                        format_bytes(budget), format_bytes(rss))
+
+    def shutdown(self):
+        self._stop.set()
+
+    def _watchdog_loop(self):
+        while not self._stop.wait(DEFAULT_CHECK_INTERVAL):
+            try:
+                self.check()
+            except Exception as e:
+                log.error("Error in model watchdog: %s", e, exc_info=True)
+
+    def _load(self, entry):
+        log.info("Loading model '%s'.", entry.name)
+        rss_before = self.process_rss()
+        started = time.perf_counter()
+        instance = entry.loader()
+        size = self._measure(entry, instance)
+        if size is None:
+            size = max(self.process_rss() - rss_before, 0)
+        entry.instance = instance
+        entry.size_bytes = size
+        log.info("Loaded model '%s' (%s).", entry.name, format_bytes(size),
+                 extra={"stage": "model_load", "duration": time.perf_counter() - started})
+
+    def _measure(self, entry, instance):
+        try:
+            if entry.measure is not None:
+                return entry.measure(instance)
+            return torch_module_bytes(instance)
+        except Exception as e:
+            log.warning("Could not measure model '%s': %s", entry.name, e)
+            return None
+
+    @staticmethod
+    def _release_memory():
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def torch_module_bytes(obj):
+    """
+    Size of the parameters and buffers of a torch module (or of the modules in
+    a tuple/list), or None if ``obj`` contains no modules.
+    """
+    if isinstance(obj, torch.nn.Module):
+        tensors = list(obj.parameters()) + list(obj.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    if isinstance(obj, (tuple, list)):
+        sizes = [torch_module_bytes(item) for item in obj]
+        sizes = [size for size in sizes if size is not None]
+        return sum(sizes) if sizes else None
+    return None
+
+
+def format_bytes(size):
+    if size is None:
+        return "unknown"
+    return f"{size / (1024 * 1024):.0f} MB"
+
+
+# Singleton instance
+model_manager = ModelManager()
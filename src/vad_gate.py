@@ -0,0 +1,224 @@
+import time
+
+import numpy as np
+import torch
+
+from usersettings import user_settings
+from log_setup import get_logger
+
+log = get_logger("vad")
+
+SAMPLE_RATE = 16000
+
+DEFAULT_MARGIN_DB = 9.0  # How far above the noise floor a frame must be to wake the VAD
+DEFAULT_MIN_LEVEL_DB = -55.0  # Frames quieter than this never wake the VAD
+DEFAULT_MAX_ZCR = 0.35  # Zero-crossing rate above which a frame looks like hiss
+DEFAULT_HANGOVER_MS = 400  # Keep the VAD awake this long after the last loud frame
+DEFAULT_BOOTSTRAP_MS = 500  # The noise floor is initialised from this much audio
+DEFAULT_FLOOR_RISE_DB_PER_S = 1.5  # Fastest the noise floor may rise, so speech cannot drag it up
+DEFAULT_WAKE_THRESHOLD = 0.5
+DEFAULT_WAKE_WINDOW_S = 8.0  # How long a detected wake phrase keeps the VAD armed
+STATS_LOG_INTERVAL_S = 60.0
+
+
+class EnergyGate:
+    """
+    Cheap first tier of speech detection.
+
+    Looks at frame energy and zero-crossing rate against a noise floor that
+    adapts to the room, and only lets through frames that could contain speech.
+    """
+    def __init__(self, margin_db=DEFAULT_MARGIN_DB, min_level_db=DEFAULT_MIN_LEVEL_DB,
+                 max_zcr=DEFAULT_MAX_ZCR, hangover_frames=0, bootstrap_frames=15, max_rise_db=0.05):
+        self.margin_db = margin_db
+        self.min_level_db = min_level_db
+        self.max_zcr = max_zcr
+        self.hangover_frames = hangover_frames
+        self.bootstrap_frames = bootstrap_frames
+        self.max_rise_db = max_rise_db  # Per frame
+        self.noise_floor_db = min_level_db - margin_db
+        self.level = 0.0  # Last frame level in [0, 1] for the activity meter
+        self._hangover = 0
+        self._bootstrap = []
+
+    @staticmethod
+    def measure(samples):
+        """
+        Returns ``(level_db, zcr)`` for a float32 frame in [-1, 1].
+        """
+        rms = np.sqrt(np.mean(np.square(samples, dtype=np.float32)) + 1e-12)
+        level_db = 20.0 * np.log10(rms)
+        zcr = np.count_nonzero(np.diff(np.signbit(samples))) / max(len(samples) - 1, 1)
+        return float(level_db), float(zcr)
+
+    def process(self, samples):
+        """
+        Returns True if the frame should be passed on to the next tier.
+        """
+        level_db, zcr = self.measure(samples)
+        self.level = min(max((level_db + 60.0) / 60.0, 0.0), 1.0)
+
+        threshold = max(self.noise_floor_db + self.margin_db, self.min_level_db)
+        loud = level_db > threshold
+        # High-ZCR frames are usually broadband noise, unless they are well
+        # above the floor (fricatives such as "s" and "f").
+        active = loud and (zcr < self.max_zcr or level_db > threshold + self.margin_db)
+
+        self._track_noise_floor(level_db)
+
+        if active:
+            self._hangover = self.hangover_frames
+            return True
+        if self._hangover > 0:
+            self._hangover -= 1
+            return True
+        return False
+
+    def _track_noise_floor(self, level_db):
+        """
+        Updates the noise floor from every frame, loud or not, so steady room
+        noise above the minimum level is learned instead of waking the VAD
+        forever. The floor follows drops quickly but rises by at most
+        ``max_rise_db`` per frame, which speech is too short to move much.
+        """
+        if self._bootstrap is not None:
+            self._bootstrap.append(level_db)
+            if len(self._bootstrap) < self.bootstrap_frames:
+                return
+            # Use the quieter bootstrap frames, in case listening starts mid-speech
+            self.noise_floor_db = float(np.percentile(self._bootstrap, 20))
+            self._bootstrap = None
+            log.debug("Noise floor initialised at %.1f dBFS.", self.noise_floor_db)
+            return
+        if level_db < self.noise_floor_db:
+            self.noise_floor_db += 0.3 * (level_db - self.noise_floor_db)
+        else:
+            self.noise_floor_db += min(0.02 * (level_db - self.noise_floor_db), self.max_rise_db)
+
+
+class WakePhraseStage:
+    """
+    Optional second tier that keeps the neural VAD disarmed until a wake
+    phrase is heard. Uses openWakeWord when it is installed and a wake word
+    model is configured in ``wake_word_model``; otherwise it is a no-op.
+    """
+    def __init__(self, model_name=None, threshold=DEFAULT_WAKE_THRESHOLD, window_s=DEFAULT_WAKE_WINDOW_S):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.window_s = window_s
+        self.model = None
+        self._armed_until = 0.0
+        if model_name:
+            try:
+                from openwakeword.model import Model
+                self.model = Model(wakeword_models=[model_name])
+                log.info("Wake phrase detection enabled with model '%s'.", model_name)
+            except Exception as e:
+                log.warning("Wake phrase model '%s' unavailable, detection disabled: %s", model_name, e)
+
+    @property
+    def enabled(self):
+        return self.model is not None
+
+    def arm(self):
+        """Keeps the VAD armed for another window, e.g. while a conversation is ongoing."""
+        self._armed_until = time.monotonic() + self.window_s
+
+    def process(self, samples):
+        """
+        Returns True if frames should reach the neural VAD.
+        """
+        if not self.enabled or time.monotonic() < self._armed_until:
+            return True
+        scores = self.model.predict((samples * 32767).astype(np.int16))
+        if max(scores.values(), default=0.0) >= self.threshold:
+            log.info("Wake phrase detected.")
+            self.arm()
+        # The frame carrying the wake phrase itself is not part of the query
+        return False
+
+
+class SpeechDetector:
+    """
+    Tiered speech detection: energy gate, optional wake phrase, then Silero VAD.
+
+    Silero only runs on frames that get through the cheaper tiers, which keeps
+    idle CPU use low. Counts of frames rejected at each tier are kept in
+    ``stats``.
+    """
+    def __init__(self, vad_model, frame_size):
+        frame_ms = 1000.0 * frame_size / SAMPLE_RATE
+        self.vad_model = vad_model
+        self.gate = EnergyGate(
+            margin_db=user_settings.get("vad_gate_margin_db", DEFAULT_MARGIN_DB),
+            min_level_db=user_settings.get("vad_gate_min_level_db", DEFAULT_MIN_LEVEL_DB),
+            hangover_frames=int(user_settings.get("vad_gate_hangover_ms", DEFAULT_HANGOVER_MS) / frame_ms),
+            bootstrap_frames=max(int(DEFAULT_BOOTSTRAP_MS / frame_ms), 1),
+            max_rise_db=DEFAULT_FLOOR_RISE_DB_PER_S * frame_ms / 1000.0,
+        )
+        self.wake = WakePhraseStage(
+            model_name=user_settings.get("wake_word_model", None),
+            threshold=user_settings.get("wake_word_threshold", DEFAULT_WAKE_THRESHOLD),
+        )
+        self.gate_enabled = user_settings.get("vad_energy_gate", True)
+        self.stats = {"frames": 0, "rejected_energy": 0, "rejected_wake": 0, "vad_runs": 0, "vad_speech": 0}
+        self._vad_awake = False
+        self._last_stats_log = time.monotonic()
+
+    def process(self, samples, force=False):
+        """
+        Returns the speech probability of a float32 frame at 16 kHz. Frames
+        rejected by the cheap tiers report 0.0. ``force`` skips the cheap
+        tiers, e.g. while an utterance is already being recorded.
+        """
+        self.stats["frames"] += 1
+
+        if not force:
+            if self.gate_enabled and not self.gate.process(samples):
+                self.stats["rejected_energy"] += 1
+                self._vad_awake = False
+                self._maybe_log_stats()
+                return 0.0
+            if not self.wake.process(samples):
+                self.stats["rejected_wake"] += 1
+                self._vad_awake = False
+                self._maybe_log_stats()
+                return 0.0
+
+        if not self._vad_awake:
+            # Silero is recurrent; its state is stale after skipped frames
+            self.vad_model.reset_states()
+            self._vad_awake = True
+
+        self.stats["vad_runs"] += 1
+        speech_prob = self.vad_model(torch.from_numpy(samples), SAMPLE_RATE).item()
+        if speech_prob > 0.5:
+            self.stats["vad_speech"] += 1
+            if self.wake.enabled:
+                self.wake.arm()
+        self._maybe_log_stats()
+        return speech_prob
+
+    @property
+    def level(self):
+        """Cheap input level in [0, 1] for frames that never reach the VAD."""
+        return self.gate.level
+
+    def rejection_rates(self):
+        frames = max(self.stats["frames"], 1)
+        return {
+            "energy": self.stats["rejected_energy"] / frames,
+            "wake": self.stats["rejected_wake"] / frames,
+            "vad": self.stats["vad_runs"] / frames,
+        }
+
+    def _maybe_log_stats(self):
+        now = time.monotonic()
+        if now - self._last_stats_log < STATS_LOG_INTERVAL_S:
+            return
+        self._last_stats_log = now
+        rates = self.rejection_rates()
+        log.info("Detector tiers: %d frames, %.1f%% rejected by energy gate, %.1f%% by wake phrase, "
+                 "%.1f%% reached VAD (%d speech), noise floor %.1f dBFS",
+                 self.stats["frames"], 100 * rates["energy"], 100 * rates["wake"], 100 * rates["vad"],
+                 self.stats["vad_speech"], self.gate.noise_floor_db)
@@ -0,0 +1,39 @@
+import numpy as np
+from scipy import signal
+
+from audio_preprocessing import AudioPreprocessor, PreprocessingStats, StreamingResampler, TARGET_RATE
+
+
+def test_equal_rates_pass_through():
+    resampler = StreamingResampler(TARGET_RATE, TARGET_RATE)
+    assert resampler.passthrough
+    samples = np.arange(100, dtype=np.float32)
+    assert np.array_equal(resampler.process(samples), samples)
+
+
+def test_preprocessor_at_target_rate():
+    for channels in (1, 2):
+        preprocessor = AudioPreprocessor(TARGET_RATE, channels, 512)
+        data = (np.ones(1024 * channels) * 16384).astype(np.int16).tobytes()
+        frames = preprocessor.process(data)
+        assert len(frames) == 2
+        assert np.allclose(frames[0], 0.5)
+
+
+def test_streaming_matches_resample_poly():
+    rng = np.random.default_rng(0)
+    samples = rng.standard_normal(48000).astype(np.float32)
+    resampler = StreamingResampler(48000, TARGET_RATE)
+    streamed = np.concatenate([resampler.process(block) for block in np.array_split(samples, 37)])
+    reference = signal.resample_poly(samples, 1, 3)
+    delay = 10  # Output samples of filter latency at 48 kHz -> 16 kHz
+    assert np.allclose(streamed[delay:], reference[:len(streamed) - delay], atol=1e-4)
+
+
+def test_stats_accumulate_across_preprocessors():
+    stats = PreprocessingStats()
+    data = np.zeros(1536, dtype=np.int16).tobytes()
+    for _ in range(3):
+        AudioPreprocessor(48000, 1, 512, stats=stats).process(data)
+    assert stats.formats[(48000, 1)]["blocks"] == 3
+    assert abs(stats.formats[(48000, 1)]["audio_time"] - 3 * 1536 / 48000) < 1e-9
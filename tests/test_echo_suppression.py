@@ -0,0 +1,73 @@
+import numpy as np
+
+from echo_suppression import EchoReference, EchoSuppressor, BargeInDetector, SAMPLE_RATE
+
+FRAME = 512
+DELAY_S = 0.15
+
+
+def speech_like(seconds, seed):
+    """Band-limited noise with a syllable-rate envelope."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    noise = np.convolve(rng.standard_normal(n), np.hanning(16), mode="same")
+    envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4 * np.arange(n) / SAMPLE_RATE)
+    return (0.05 * noise * envelope).astype(np.float32)
+
+
+def run(echo_gain, user=None, user_start_s=None, seconds=4.0):
+    """
+    Plays a reference, feeds the microphone its delayed, scaled echo (plus
+    ``user`` speech from ``user_start_s``) and reports, for every frame, the
+    input and output energy and whether a barge-in fired. The VAD is assumed
+    to call every frame speech, as Silero does for the assistant's own voice.
+    """
+    reference = EchoReference()
+    played = speech_like(seconds, seed=1)
+    reference.push(played, start_time=0.0)
+    delay = int(DELAY_S * SAMPLE_RATE)
+    mic = np.zeros_like(played)
+    mic[delay:] = echo_gain * played[:-delay]
+    if user is not None:
+        start = int(user_start_s * SAMPLE_RATE)
+        mic[start:start + len(user)] += user[:len(mic) - start]
+    mic += 1e-4 * np.random.default_rng(2).standard_normal(len(mic)).astype(np.float32)
+
+    suppressor = EchoSuppressor(reference, FRAME)
+    detector = BargeInDetector()
+    frames = []
+    for i in range(len(mic) // FRAME):
+        frame = mic[i * FRAME:(i + 1) * FRAME]
+        cleaned = suppressor.process(frame, (i + 1) * FRAME / SAMPLE_RATE)
+        fired = detector.update(0.9, suppressor.residual_ratio, echo_converged=suppressor.converged)
+        frames.append((float(np.sum(frame ** 2)), float(np.sum(cleaned ** 2)), fired))
+    return suppressor, frames
+
+
+def attenuation_db(frames, from_frame):
+    energy_in = sum(f[0] for f in frames[from_frame:])
+    energy_out = sum(f[1] for f in frames[from_frame:])
+    return 10 * np.log10(energy_in / energy_out)
+
+
+def test_finds_delay_and_suppresses_echo():
+    suppressor, frames = run(echo_gain=0.5)
+    assert abs(suppressor.delay - DELAY_S) < 0.002
+    assert attenuation_db(frames, from_frame=62) > 15
+    assert not any(f[2] for f in frames)
+
+
+def test_echo_louder_than_reference_does_not_self_interrupt():
+    suppressor, frames = run(echo_gain=2.0)
+    assert suppressor.converged
+    assert abs(suppressor.delay - DELAY_S) < 0.002
+    assert attenuation_db(frames, from_frame=62) > 15
+    assert not any(f[2] for f in frames)
+
+
+def test_user_speech_over_echo_barges_in():
+    user = 4 * speech_like(1.0, seed=3)
+    _, frames = run(echo_gain=2.0, user=user, user_start_s=2.5)
+    fired = [i for i, f in enumerate(frames) if f[2]]
+    assert fired
+    assert fired[0] * FRAME / SAMPLE_RATE >= 2.5
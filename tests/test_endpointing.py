@@ -0,0 +1,117 @@
+import threading
+
+import endpointing
+from endpointing import EndpointDetector, SpeculativeRequest, CONTINUE, SPECULATE, END
+
+FRAME_S = 0.032
+
+
+def feed(detector, probs):
+    return [detector.update(p) for p in probs]
+
+
+def frames(seconds):
+    return int(round(seconds / FRAME_S))
+
+
+def test_ends_after_initial_silence_and_speculates_first():
+    detector = EndpointDetector(FRAME_S)
+    decisions = feed(detector, [0.9] * 20 + [0.05] * 60)
+    assert decisions.index(SPECULATE) < decisions.index(END)
+    # Silence before END: the default, stretched while the VAD trend decays
+    assert 0.9 <= (decisions.index(END) - 20 + 1) * FRAME_S <= 1.3
+
+
+def test_adapts_to_the_users_pauses():
+    detector = EndpointDetector(FRAME_S)
+    for _ in range(10):
+        feed(detector, [0.9] * 20 + [0.05] * frames(0.25))
+    detector.start_utterance()
+    assert detector.required_silence() == detector.min_silence
+
+
+def test_continuation_word_waits_longer():
+    detector = EndpointDetector(FRAME_S)
+    baseline = detector.required_silence()
+    detector.set_partial_transcript("I want to go to the shop and")
+    assert detector.required_silence() > baseline
+
+
+def test_speculation_is_debounced_after_resume():
+    detector = EndpointDetector(FRAME_S)
+    pause = [0.05] * frames(0.35)
+    decisions = feed(detector, [0.9] * 20 + pause + [0.9] * 5 + pause)
+    # The second pause follows too little speech to speculate again
+    assert decisions.count(SPECULATE) == 1
+    decisions = feed(detector, [0.9] * frames(1.2) + pause)
+    assert decisions.count(SPECULATE) == 1
+
+
+def test_premature_end_raises_required_silence(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(endpointing.time, "monotonic", lambda: clock[0])
+    detector = EndpointDetector(FRAME_S)
+    before = detector.required_silence()
+    decisions = feed(detector, [0.9] * 20 + [0.05] * 60)
+    assert END in decisions
+    # The user carries on half a second after the END
+    clock[0] += 0.5
+    detector.start_utterance()
+    assert detector.required_silence() > before
+    assert max(detector.pause_history) > 1.0
+
+
+def test_late_resume_is_not_premature(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(endpointing.time, "monotonic", lambda: clock[0])
+    detector = EndpointDetector(FRAME_S)
+    feed(detector, [0.9] * 20 + [0.05] * 60)
+    clock[0] += 5.0
+    detector.start_utterance()
+    assert detector.penalty == 0.0
+    assert not detector.pause_history
+
+
+class FakeRecognizer:
+    """Serialized like CentralWidget.transcribe, with a gate to hold it busy."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        self.entered = threading.Event()
+        self.calls = []
+
+    def transcribe(self, audio, cancelled=None):
+        with self.lock:
+            if cancelled is not None and cancelled.is_set():
+                return None
+            self.calls.append(audio)
+            self.entered.set()
+            self.release.wait(5)
+            return {"text": f"utterance {audio}."}
+
+
+def test_speculative_request_returns_response():
+    recognizer = FakeRecognizer()
+    recognizer.release.set()
+    partials = []
+    request = SpeculativeRequest(1, recognizer.transcribe, lambda text: text.upper(), on_transcript=partials.append)
+    assert request.wait_response() == "UTTERANCE 1."
+    assert request.wait_transcript() == "utterance 1."
+    assert partials == ["utterance 1."]
+
+
+def test_cancelled_requests_skip_transcription():
+    recognizer = FakeRecognizer()
+    queried = []
+    busy = SpeculativeRequest(0, recognizer.transcribe, queried.append)
+    assert recognizer.entered.wait(5)
+    stale = [SpeculativeRequest(i, recognizer.transcribe, queried.append) for i in (1, 2)]
+    for request in [busy] + stale:
+        request.cancel()
+    recognizer.release.set()
+    for request in [busy] + stale:
+        assert request.wait_response() is None
+        request.done.wait(5)
+    # Only the request already inside the recogniser ran it, and nothing reached the LLM
+    assert recognizer.calls == [0]
+    assert queried == []
@@ -0,0 +1,126 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from usersettings import user_settings
+from llm_backend import LLMBackend, LOCAL_API_KEY, check_server, create_client
+
+OPENAI_KEY = "sk-real-openai-key"
+
+
+class StandInServer:
+    """
+    Minimal OpenAI-compatible server on localhost that records every request.
+    """
+    def __init__(self, models):
+        self.models = models
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, body):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                server.requests.append((self.path, self.headers.get("Authorization"), None))
+                self._reply({"object": "list", "data": [
+                    {"id": model, "object": "model", "created": 0, "owned_by": "local"} for model in server.models]})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server.requests.append((self.path, self.headers.get("Authorization"), body))
+                self._reply({
+                    "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "Hello from the stand-in"}}],
+                })
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", OPENAI_KEY)
+    monkeypatch.setitem(user_settings.settings, "OPENAI_API_KEY", OPENAI_KEY)
+    servers = []
+
+    def start(models):
+        server = StandInServer(models)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_custom_server_never_receives_the_openai_key(stand_in):
+    server = stand_in(["llama3.2:latest"])
+    for llm_api_key, expected in ((None, LOCAL_API_KEY), ("server-token", "server-token")):
+        client = create_client(server.base_url, llm_api_key)
+        client.chat.completions.create(model="llama3.2", messages=[{"role": "user", "content": "Hi"}])
+        check_server(client, server.base_url, "llama3.2")
+        assert {auth for _, auth, _ in server.requests} == {f"Bearer {expected}"}
+        server.requests.clear()
+
+
+def test_ollama_tag_matches_model_name(stand_in):
+    server = stand_in(["llama3.2:latest", "mistral:latest"])
+    client = create_client(server.base_url)
+    ok, message = check_server(client, server.base_url, "llama3.2")
+    assert ok, message
+    ok, message = check_server(client, server.base_url, "phi3")
+    assert not ok
+    assert "llama3.2:latest" in message
+
+
+def test_llama_cpp_single_model_accepts_any_name(stand_in):
+    server = stand_in(["models/qwen2.5-7b-instruct-q4_k_m.gguf"])
+    ok, message = check_server(create_client(server.base_url), server.base_url, "default")
+    assert ok, message
+
+
+def test_unreachable_server_fails_health_check(stand_in):
+    server = stand_in([])
+    server.close()
+    ok, message = check_server(create_client(server.base_url), server.base_url, "default")
+    assert not ok
+    assert "Cannot reach" in message
+
+
+def test_backend_completes_and_warms_up_with_one_token(stand_in, monkeypatch):
+    server = stand_in(["default"])
+    monkeypatch.setitem(user_settings.settings, "llm_base_url", server.base_url)
+    monkeypatch.setitem(user_settings.settings, "llm_model", "default")
+    backend = LLMBackend()
+    assert backend.health_check()[0]
+    assert backend.healthy
+
+    backend.warm_up()
+    _, auth, body = server.requests[-1]
+    assert body["max_tokens"] == 1
+    assert auth == f"Bearer {LOCAL_API_KEY}"
+
+    messages = backend.build_messages("What is on my screen?", screenshot_path="unused.png")
+    assert backend.complete(messages) == "Hello from the stand-in"
+    _, _, body = server.requests[-1]
+    # Local models default to text-only, so the screenshot is left out
+    assert body["messages"][1]["content"] == "What is on my screen?"
+    assert body["max_tokens"] == backend.max_tokens
@@ -0,0 +1,26 @@
+import json
+import logging
+import queue
+
+from log_setup import DeferredQueueHandler, JsonFormatter
+
+
+def test_exception_is_a_separate_json_field():
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("test_log_setup")
+    logger.propagate = False
+    handler = DeferredQueueHandler(log_queue)
+    logger.addHandler(handler)
+    try:
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.error("Failed on %s", "frame", exc_info=True, extra={"stage": "asr"})
+    finally:
+        logger.removeHandler(handler)
+
+    entry = json.loads(JsonFormatter().format(log_queue.get_nowait()))
+    assert entry["message"] == "Failed on frame"
+    assert entry["stage"] == "asr"
+    assert "Traceback" in entry["exception"]
+    assert "ValueError: boom" in entry["exception"]
@@ -0,0 +1,56 @@
+import numpy as np
+
+from vad_gate import EnergyGate, DEFAULT_BOOTSTRAP_MS, DEFAULT_FLOOR_RISE_DB_PER_S, DEFAULT_HANGOVER_MS, SAMPLE_RATE
+
+FRAME = 512
+FRAME_MS = 1000.0 * FRAME / SAMPLE_RATE
+
+
+def make_gate():
+    # Configured the way SpeechDetector configures it
+    return EnergyGate(
+        hangover_frames=int(DEFAULT_HANGOVER_MS / FRAME_MS),
+        bootstrap_frames=int(DEFAULT_BOOTSTRAP_MS / FRAME_MS),
+        max_rise_db=DEFAULT_FLOOR_RISE_DB_PER_S * FRAME_MS / 1000.0,
+    )
+
+
+def hum(levels_db):
+    """100 Hz hum at the given RMS level per frame, over a faint noise floor."""
+    rng = np.random.default_rng(0)
+    t = np.arange(FRAME) / SAMPLE_RATE
+    for i, level_db in enumerate(levels_db):
+        amplitude = np.sqrt(2) * 10 ** (level_db / 20)
+        tone = amplitude * np.sin(2 * np.pi * 100 * (t + i * FRAME / SAMPLE_RATE))
+        yield (tone + 1e-4 * rng.standard_normal(FRAME)).astype(np.float32)
+
+
+def run(levels_db):
+    gate = make_gate()
+    passed = [gate.process(frame) for frame in hum(levels_db)]
+    return gate, passed
+
+
+def test_steady_hum_is_learned_at_startup():
+    for level_db in (-50.0, -40.0):
+        gate, passed = run([level_db] * 2000)  # 64 s
+        assert abs(gate.noise_floor_db - level_db) < 1.0
+        # Only the bootstrap frames and their hangover reach the VAD
+        assert sum(passed) < 40
+        assert not any(passed[100:])
+
+
+def test_hum_starting_later_is_learned():
+    gate, passed = run([-70.0] * 150 + [-40.0] * 1850)
+    assert abs(gate.noise_floor_db + 40.0) < 1.0
+    # The floor rises at most 1.5 dB/s, so the hum is learned within about 20 s
+    assert not any(passed[150 + int(20000 / FRAME_MS):])
+
+
+def test_speech_does_not_drag_the_floor_up():
+    # 2 s bursts 45 dB above a quiet room, every 6 s
+    levels = ([-65.0] * 125 + [-20.0] * 62) * 10
+    gate, passed = run(levels)
+    assert gate.noise_floor_db < -60.0
+    burst_frames = [i for i, level in enumerate(levels) if level == -20.0]
+    assert all(passed[i] for i in burst_frames)